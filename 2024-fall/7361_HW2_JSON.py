@@ -29,104 +29,46 @@ if __name__ == "__main__":
     calculate_average_speed(input_file, output_csv)
   
 # PART 2
-import csv
-from operator import itemgetter
-import operator
+import os
 import time
-import heapq
-import matplotlib.pyplot as plt
 
-#from itertools import imap
-# this file splits the large file into smaller files, and sort each smaller file based on each column defined
-def split_sort(file_name, lines_per_file, column):
-    lines_per_file = lines_per_file
-    #smallfile = None
-    small_filename = 'small_file_{}.txt'.format(lines_per_file)
-    smallfile = open(small_filename, "w")
-    with open(file_name) as bigfile:
-        bigfile.readline() # skip header
-        for lineno, line in enumerate(bigfile):
-            if lineno % lines_per_file == 0 and lineno > 0: # if the number of lines in the current small file reaches the limit, sort it and open a new small file
-                if smallfile:
-                    small_file_sorted = 'small_file_{}_s.txt'.format(lineno)
-                    sort_file(small_filename, small_file_sorted, column)
-                    print(small_file_sorted + ' sorted')
-                    sorted_file_list.append(small_file_sorted) # add filename of the sorted file to a list
-                    smallfile.close()
-                small_filename = 'small_file_{}.txt'.format(lineno + lines_per_file)
-                smallfile = open(small_filename, "w")
-            smallfile.write(line) # write the line into the small file
-        if smallfile: # sort and close the last small file
-            small_file_sorted = 'small_file_{}_s.txt'.format(lineno)
-            sort_file(small_filename, small_file_sorted, column)
-            sorted_file_list.append(small_file_sorted)
-            print(small_file_sorted + ' sorted')
-            smallfile.close()
-    return sorted_file_list
-
-def sort_file(infile, outfile, column): # sort a file based on the given column
-   reader = csv.reader(open(infile), delimiter=",")
-   #next(reader)
-   f = open(outfile,'w')
-   for line in sorted(reader, key = lambda x: int(itemgetter(column)(x))):
-      for item in line:
-         f.write("%s\t" % item)
-      f.write("\n")
-
-def extract_key(line,key_column):
-    """Extract the key column
-    """
-    return int(line.split('\t')[key_column]) # for example
-
-def merge_sort_files(file_list, key_index) :
-
-    files = map(open, file_list)
-    with open("merged.txt", "w") as dest:
-        #dest.writelines(heapq.merge(*files, key=extract_key(key_index)))
-
-        decorated = [
-            ((extract_key(line,key_index), line) for line in f)
-            for f in files] # mark which column each line needs to be sorted based on
-        merged = heapq.merge(*decorated) # the star sign allows variable number of arguments passed to the function
-        undecorated = map(itemgetter(-1), merged) # get the second item of the merged results, which conresponds to the lines to be merged
-        dest.writelines(undecorated)
+# external_sort.py replaces split_sort / sort_file / merge_sort_files: runs are sized by a memory budget
+# instead of lines_per_file, every run is sorted on a numeric key array, the runs are merged k ways
+# through buffered blocks (in several passes if there are too many), and the temporary runs are removed.
+# Lines are copied unchanged, so merged.txt keeps the csv format and header of the input file.
+from external_sort import external_sort
 
 sort_column = 7
-lines_per_file = 50000
-sorted_file_list=[]
-start_time = time.time()
-
-# yellow_tripdata_2020-01.csv is the large file to be sorted
-
-sorted_file_list = split_sort('yellow_tripdata_2020-01.csv',lines_per_file, sort_column)
-print ("merging all sorted files...this may take a few minutes...be patient...")
-merge_sort_files(sorted_file_list,sort_column)
-end_time = time.time()
 
-print ("The runtime of the entire process is " +str(end_time - start_time)+ " seconds.")
-
-
-# List of different lines_per_file values
-lines_per_file_values = [20000, 30000, 40000, 50000, 60000, 70000, 80000]
-sorted_file_list=[] # without this code, the runtime constantly increase
-runtimes = []
+# n_workers processes sort the runs while a reader thread reads ahead, and the merge prefetches every run;
+# the pool needs the main guard (worker processes may import this file)
+if __name__ == "__main__":
+    from sort_benchmark import auto_config, benchmark_sort, default_configs # only the main process runs the benchmark
 
-for lines_per_file in lines_per_file_values:
-    print(f"Running with lines_per_file={lines_per_file}...")
     start_time = time.time()
 
-    sorted_file_list = split_sort('yellow_tripdata_2020-01.csv', lines_per_file, 7)
-    merge_sort_files(sorted_file_list, 7)
-
+    # yellow_tripdata_2020-01.csv is the large file to be sorted; memory budget and merge fan-in are picked
+    # from the memory available on this machine
+    settings = auto_config('yellow_tripdata_2020-01.csv', n_workers=os.cpu_count())
+    info = external_sort('yellow_tripdata_2020-01.csv', 'merged.txt', sort_column, **settings)
     end_time = time.time()
-    runtime = end_time - start_time
-    runtimes.append(runtime)
-    print(f"Runtime for lines_per_file={lines_per_file}: {runtime} seconds")
 
-# Plotting the results
-plt.figure()
-plt.plot(lines_per_file_values, runtimes, marker='o')
-plt.xlabel('Number of Lines per File')
-plt.ylabel('Time (seconds)')
-plt.grid(True)
-plt.show()
+    print(f"{info['rows']} rows sorted in {info['runs']} runs and {info['merge_passes']} merge pass(es)")
+    print ("The runtime of the entire process is " +str(end_time - start_time)+ " seconds.")
+
+
+# Benchmark: every configuration runs in a fresh process (no state shared between runs) and records the
+# split / sort / merge times, peak memory and bytes read and written; auto_config picks the memory budget and
+# merge fan-in from the available memory, and default_configs sweeps budgets around that pick.
+# The results go to sort_benchmark.json so later runs can be compared with them.
+if __name__ == "__main__":
+    configs = [config for n_workers in sorted({1, os.cpu_count()})
+               for config in default_configs('yellow_tripdata_2020-01.csv', n_workers)]
+    results = benchmark_sort('yellow_tripdata_2020-01.csv', sort_column, configs, out_json='sort_benchmark.json')
+
+    for run in results['runs']:
+        config = run['config']
+        phases = ', '.join(f"{phase} {seconds:.1f}s" for phase, seconds in run['timings'].items())
+        peak = 'n/a' if run['peak_rss'] is None else f"{run['peak_rss'] // 2**20} MB" # not measured on Windows
+        print(f"memory_budget={config['memory_budget'] // 2**20} MB, fan_in={config['fan_in']}, n_workers={config['n_workers']}: "
+              f"{run['wall']:.1f} seconds ({phases}), peak RSS {peak}")
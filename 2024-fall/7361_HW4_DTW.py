@@ -8,6 +8,8 @@ from shapely.geometry import LineString
 import geopandas as gpd
 from shapely import wkt
 import math
+from trajectory_dtw import parallel_pairwise, condensed_to_pair
+from trajectory_io import open_checkins
 
 """
 # example 1
@@ -25,42 +27,15 @@ print(distance)
 # 2.8284271247461903
 """
 
-# read data and store user id and location into a dict.
-counter_user = 0
-user_coor_dict = {}  # a dictionary that stores the coordinates of all users. Key: user ID, value: a list that stores the coordinates of this user
-
-with open('weibo_users_subset.txt') as f:
-    file = f.readline() # skip header
-    
-    # calculate the rog of all users in the provided file
-    file = f.readlines()  # read all the lines in the weibo file
-    previous_user_id = -1 # track if current user is the first user
-    
-    for j in file:
-        data =j.strip('\n').split('\t')
-        current_user_id = data[0] # get user id of the current row
-        current_user_lon = float(data[1]) # get longitude of the current row
-        current_user_lat= float(data[2]) # get latitude of the current row
-        
-        if current_user_id in user_coor_dict: # if some of this user's lat/lon have been added to the dictionary
-            user_coor_dict[current_user_id].append((current_user_lon,current_user_lat)) # keep adding to the lon/lat list where the key is the user id
-        
-        else: # if this is a new user
-            # create a new key
-            user_coor_dict[current_user_id]= []
-
-            # add current lat/lon as the first point of this user
-            user_coor_dict[current_user_id].append((current_user_lon, current_user_lat))
-            counter_user += 1
-            print('user ' + str(counter_user) + ' extracted')
-        previous_user_id = current_user_id
-
-print (user_coor_dict) # done reading data
+# read data into packed arrays: one coordinate array for all check-ins plus a per-user offsets index
+# (user k owns coords[offsets[k]:offsets[k + 1]]), memory-mapped from weibo_users_subset.store (created on the first run).
+# Only the main process opens the store; the pool workers get the arrays from parallel_pairwise
+if __name__ == "__main__":
+    user_ids, coords, offsets = open_checkins('weibo_users_subset.txt')
+    print (str(len(user_ids)) + ' users extracted') # done reading data
 
 
 #calculate the dtw distance between users
-out_file = open("weibo_subset_dtw_dist.txt", 'w') # open output file to store the calculated dtw distances
-out_file.write("id1\tid2\tdtw_dist\n")
 
 """
 # test
@@ -93,53 +68,48 @@ for i in range(len(user_id_pair)):
     print(distance)
 """
 
-user_id_pair = list(itertools.combinations(user_coor_dict, 2)) # combine user_id in 6,105 pairs (combinations: 111 users * 110 / 2)
-
-id1 = []
-id2 = []
-dtw_list = []
-
-for i in range(len(user_id_pair)):
-    user_id_1 = user_id_pair[i][0] # get the first user_id from the pair
-    user_id_2 = user_id_pair[i][1] # get the second user_id from the pair
-
-    x = user_coor_dict[user_id_1] # assign the coordinate list corresponding to user_id_1 to x
-    y = user_coor_dict[user_id_2] # assign the coordinate list corresponding to user_id_2 to y
-
-    distance, path = fastdtw(x, y, dist=euclidean) # calculate dtw
-
-    id1.append(user_id_1)
-    id2.append(user_id_2)
-    dtw_list.append(distance)
-
-    out_file.write(f"{id1[i]}\t{id2[i]}\t{dtw_list[i]}\n")
+# user pairs follow itertools.combinations(user_ids, 2): 6,105 pairs (combinations: 111 users * 110 / 2)
 
+# compute the dtw of all pairs in blocks on a process pool
+# (exact dtw; pass window=... for a Sakoe-Chiba band). Results are written in itertools.combinations order
+# the analysis steps sit under the main guard so that pool workers (which re-import this script on
+# Windows/macOS) do not run them again
+if __name__ == "__main__":
+    dtw_list = parallel_pairwise(coords, offsets, metric='dtw', user_ids=user_ids,
+                                 out_file="weibo_subset_dtw_dist.txt", header="id1\tid2\tdtw_dist\n")
 
-# Q2: Which two users have the largest dtw distance value in the sample set? Plot the check-in points of these two users as polylines on a map. What spatial patterns can you observe?
-df = pd.read_csv('weibo_subset_dtw_dist.txt', sep = '\t', names=['id1', 'id2', 'dtw_dist'], header = 0)
-df.sort_values('dtw_dist', ascending = False) #id: 1045049335, id2: 1074028031, dtw_dist: 15091338.2966096
+    # Q2: Which two users have the largest dtw distance value in the sample set? Plot the check-in points of these two users as polylines on a map. What spatial patterns can you observe?
+    # dtw_list already holds every pair, so the largest one is an argmax over it; condensed_to_pair turns the condensed
+    # index back into the two users (trajectory_topk.top_k_pairs answers this without the full pass above)
+    largest = int(np.argmax(dtw_list))
+    row, col = condensed_to_pair(len(user_ids), largest)
+    largest_ids = [int(user_ids[row]), int(user_ids[col])]
+    print(largest_ids, dtw_list[largest])
 
-largest_dtw = pd.read_csv('weibo_users_subset.txt', sep = '\t')
-largest_dtw = largest_dtw.loc[(largest_dtw['UID'] == 1045049335) | (largest_dtw['UID'] == 1074028031), :]
-largest_dtw.to_csv('largest_dtw.csv', index = False)
+    largest_dtw = pd.read_csv('weibo_users_subset.txt', sep = '\t')
+    largest_dtw = largest_dtw.loc[largest_dtw['UID'].isin(largest_ids), :]
+    largest_dtw.to_csv('largest_dtw.csv', index = False)
 
-# convert point to line
-largest_lines = largest_dtw.groupby('UID').apply(lambda row: LineString(zip(row.NEW_LON, row.NEW_LAT)))
-largest_gdf = gpd.GeoDataFrame({'UID': largest_lines.index, 'geometry': largest_lines.values}, columns = ['UID', 'geometry'])
-largest_gdf.to_file('largest_lines.shp')
+    # convert point to line
+    largest_lines = largest_dtw.groupby('UID').apply(lambda row: LineString(zip(row.NEW_LON, row.NEW_LAT)))
+    largest_gdf = gpd.GeoDataFrame({'UID': largest_lines.index, 'geometry': largest_lines.values}, columns = ['UID', 'geometry'])
+    largest_gdf.to_file('largest_lines.shp')
 
 
-# Q3: Which two users have the smallest dtw distance value in the sample set? Plot the check-in points of these two users as polylines on a map. What spatial patterns can you observe?
-df.sort_values('dtw_dist', ascending = True) #id: 1053568140, id2: 1147562814, dtw_dist: 13867.3223354688
+    # Q3: Which two users have the smallest dtw distance value in the sample set? Plot the check-in points of these two users as polylines on a map. What spatial patterns can you observe?
+    smallest = int(np.argmin(dtw_list))
+    row, col = condensed_to_pair(len(user_ids), smallest)
+    smallest_ids = [int(user_ids[row]), int(user_ids[col])]
+    print(smallest_ids, dtw_list[smallest])
 
-smallest_dtw = pd.read_csv('weibo_users_subset.txt', sep = '\t')
-smallest_dtw = smallest_dtw.loc[(smallest_dtw['UID'] == 1053568140) | (smallest_dtw['UID'] == 1147562814), :]
-smallest_dtw.to_csv('smallest_dtw.csv', index=False)
+    smallest_dtw = pd.read_csv('weibo_users_subset.txt', sep = '\t')
+    smallest_dtw = smallest_dtw.loc[smallest_dtw['UID'].isin(smallest_ids), :]
+    smallest_dtw.to_csv('smallest_dtw.csv', index=False)
 
-# convert point to line
-smallest_lines = smallest_dtw.groupby('UID').apply(lambda row: LineString(zip(row.NEW_LON, row.NEW_LAT)))
-smallest_gdf = gpd.GeoDataFrame({'UID': smallest_lines.index, 'geometry': smallest_lines.values}, columns = ['UID', 'geometry'])
-smallest_gdf.to_file('smallest_lines.shp')
+    # convert point to line
+    smallest_lines = smallest_dtw.groupby('UID').apply(lambda row: LineString(zip(row.NEW_LON, row.NEW_LAT)))
+    smallest_gdf = gpd.GeoDataFrame({'UID': smallest_lines.index, 'geometry': smallest_lines.values}, columns = ['UID', 'geometry'])
+    smallest_gdf.to_file('smallest_lines.shp')
 
 
 # Task 2. Write a python function to calculate the Euclidean distance between two trajectories
@@ -168,28 +138,11 @@ print (euclidean_dist(A,B)) # 1.0786893258332633
 print (euclidean_dist(A,C)) # -1
 """
 
-id1 = []
-id2 = []
-euc_list = []
-
-out_file = open("weibo_subset_euc_dist.txt", 'w')
-out_file.write("id1\tid2\teuc_dist\n")
-
-for i in range(len(user_id_pair)):
-    user_id_1 = user_id_pair[i][0] # get the first user_id from the pair
-    user_id_2 = user_id_pair[i][1] # get the second user_id from the pair
-
-    x = user_coor_dict[user_id_1] # assign the coordinate list corresponding to user_id_1 to x
-    y = user_coor_dict[user_id_2] # assign the coordinate list corresponding to user_id_2 to y
-
-    distance = euclidean_dist(x, y) # calculate euclidean distance
-
-    id1.append(user_id_1)
-    id2.append(user_id_2)
-    euc_list.append(distance)
-
-    out_file.write(f"{id1[i]}\t{id2[i]}\t{euc_list[i]}\n")
+# the vectorized equivalent of euclidean_dist runs on the same process pool
+if __name__ == "__main__":
+    euc_list = parallel_pairwise(coords, offsets, metric='euclidean', user_ids=user_ids,
+                                 out_file="weibo_subset_euc_dist.txt", header="id1\tid2\teuc_dist\n")
 
-# Q5 (10 pts): Out of all the user pairs, how many pairs have a valid Euclidean distance (i.e., distance other than -1)?
-euc_df = pd.read_csv('weibo_subset_euc_dist.txt', sep = '\t')
-euc_df[euc_df['euc_dist'] != -1].shape[0] #468
+    # Q5 (10 pts): Out of all the user pairs, how many pairs have a valid Euclidean distance (i.e., distance other than -1)?
+    euc_df = pd.read_csv('weibo_subset_euc_dist.txt', sep = '\t')
+    euc_df[euc_df['euc_dist'] != -1].shape[0] #468
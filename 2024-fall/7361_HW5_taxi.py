@@ -1,5 +1,6 @@
 import pandas as pd
 from collections import Counter
+from taxi_zones import zone_share_matrix, write_share_diffs
 
 def percent_by_count(my_list): # calculate the percentage of each unique item
     counter = dict(Counter(my_list))
@@ -39,30 +40,20 @@ dict2= {1:0.1, 2:0.5,4:0.1, 5:0.1}
 print (cmp_dict(dict1, dict2))
 """
 
-# import csv data and etract the zone ID
-jan_csv = pd.read_csv("yellow_tripdata_2020-01.csv")
-jan_id = jan_csv['PULocationID'].tolist()
+# import csv data and etract the zone ID: only the PULocationID column is read, as uint16, chunk by chunk
+# into running per-zone counters. Every file is aggregated in its own worker process, so the same call
+# works for a list of 12-24 monthly files; the main guard keeps the workers from re-running this script.
+# The per-zone counts are cached on disk by file content, so a re-run over the same months skips the CSVs
+if __name__ == "__main__":
+    trip_files = ["yellow_tripdata_2020-01.csv", "yellow_tripdata_2020-05.csv"]
+    shares, counts, months = zone_share_matrix(trip_files, 'PULocationID', cache_dir='.aggregate_cache') # zone x month matrix of pickup percentages
 
-may_csv = pd.read_csv("yellow_tripdata_2020-05.csv")
-may_id = may_csv['PULocationID'].tolist()
+    # compare two percentages: May minus January, an array subtraction over the zone IDs
+    write_share_diffs(shares, months, [(1, 0)], out_pattern="diff_jan_may_pu.txt")
 
-# create two dictionaries that show the percentages of zones
-jan_data = percent_by_count(jan_id)
-may_data = percent_by_count(may_id)
+    # Q. Which taxi zones had the largest decrease in the percentage of taxi pick-ups in May?
+    cmp_df = pd.read_csv('diff_jan_may_pu.txt', sep = '\t')
+    cmp_df.sort_values(by = 'percent_diff') #zone_id 161 had -0.03% and the top 3 were 161, 132, and 230
 
-# compare two percentages
-cmp_may_jan = cmp_dict(may_data, jan_data)
-cmp_may_jan2 = cmp_may_jan[2]
-
-with open("diff_jan_may_pu.txt", "w") as file:
-    file.write("zone_id\tpercent_diff\n")
-    
-    for zone_id, percent_diff in cmp_may_jan2.items():
-        file.write(f"{zone_id}\t{percent_diff}\n")
-
-# Q. Which taxi zones had the largest decrease in the percentage of taxi pick-ups in May?
-cmp_df = pd.read_csv('diff_jan_may_pu.txt', sep = '\t')
-cmp_df.sort_values(by = 'percent_diff') #zone_id 161 had -0.03% and the top 3 were 161, 132, and 230
-
-# Q. Which taxi zone had the largest increase in the percentage of taxi pick-ups in May? List the ID of this taxi zone.
-cmp_df.sort_values(ascending = False, by = 'percent_diff') #zone_id 137(0.04%)
+    # Q. Which taxi zone had the largest increase in the percentage of taxi pick-ups in May? List the ID of this taxi zone.
+    cmp_df.sort_values(ascending = False, by = 'percent_diff') #zone_id 137(0.04%)
@@ -145,16 +145,18 @@ merged_df = pd.concat([merged_co, merged_rt], axis=1)
 
 ### Split the data into weekday and weekend ###
 merged_df['Checkout Date'] = pd.to_datetime(merged_df['Checkout Date']) # convert to date type
-merged_df['Day of Week'] = merged_df['Checkout Date'].dt.weekday # assign weekday and weekend
 
-weekday_df = merged_df[merged_df['Day of Week'] < 5]
-weekday_df = weekday_df.dropna(subset=['CO ID', 'RT ID']) # select weekday 22,662 rows
+# One OD cube (checkout kiosk x return kiosk x hour) over all April trips; weekday, weekend or peak-hour flows
+# are slices of it (trips without a CO ID, RT ID or checkout time are dropped), so no csv is written and read
+# back per split
+from od_cube import ODCube, WEEKDAYS
+from extract_flows import FlowStats
 
-weekend_df = merged_df[merged_df['Day of Week'] >= 5] 
-weekend_df = weekend_df.dropna(subset=['CO ID', 'RT ID']) # select weekend 8,074 rows
-
-weekday_df.to_csv('weekday_df.csv', index = False)
-weekend_df.to_csv('weekend_df.csv', index = False)
+cube_stats = FlowStats() # trips kept and skipped
+with cube_stats.stage('cube'):
+    trip_cube = ODCube.from_frame(merged_df, 'CO ID', 'RT ID', ['Checkout Date', 'Checkout Time'], stats=cube_stats)
+print(cube_stats.summary())
+weekday_cube = trip_cube.select(weekdays=WEEKDAYS) # weekday 22,662 trips
 
 
 ########################################################################################################################
@@ -162,64 +164,16 @@ weekend_df.to_csv('weekend_df.csv', index = False)
 # 2. Identify communities
 from collections import Counter
 import pandas as pd
+from extract_flows import write_flows
 
-def count_flow(infile, col1, col2, outfile):
-    flow_count_dict = {} # Create a dictionary to store counts of flows between zone pairs
-    id_list = [] # Create a list to store unique zone IDs
-    bigfile = open(infile) # Open file
-    bigfile.readline() # Skip the header
-    for lineno, line in enumerate(bigfile):
-        # If the value in column col1 is empty, return the id_list and flow_count_dict
-        if line.split(',')[col1] == '':
-            return id_list, flow_count_dict
-
-        # Get the zone1_id and zone2_id
-        zone1_id = int(line.split(',')[col1])
-        zone2_id = int(line.split(',')[col2])
-        
-        # Skip if the zone1_id and zone2_id are the same
-        if zone1_id == zone2_id:
-            continue
-        
-        # Add zone1_id and zone2_id to id_list if it isn't already present
-        if zone1_id not in id_list:
-            id_list.append(zone1_id)
-        if zone2_id not in id_list:
-            id_list.append(zone2_id)
-        
-        # Create pairs of zone1 and zone2
-        zone_pair = (zone1_id, zone2_id)
-        zone_pair_reverse = (zone2_id, zone1_id)
-
-        # Add the flow count for each zone pair
-        if zone_pair in flow_count_dict:
-            flow_count_dict[zone_pair] += 1
-        elif zone_pair_reverse in flow_count_dict:
-            flow_count_dict[zone_pair_reverse] += 1
-        else:
-            flow_count_dict[zone_pair] = 1 # Assign 1 if the zone pair doesn't exist
-
-        # Print the line number
-        print(str(lineno)) 
-
-    # Export outfile
-    with open(outfile, "w") as output:
-        for k, v in flow_count_dict.items():
-            output.write(str(k) + '\t' + str(v) + '\n')
-    return id_list, flow_count_dict
-
-# Analyze data
-col1 = 3  # checkout kiosk id
-col2 = 6  # return kiosk id
-infile = "weekday_df.csv"
+# Undirected weekday kiosk flows without self-loops, like count_flow; pairs are keyed (min, max), while
+# count_flow keeps the orientation in which a pair first appears
+ids, id1, id2, weight = weekday_cube.flow_arrays(directed=False)
 outfile = "weekday_df.txt"
-result = count_flow(infile, col1, col2, outfile)
+write_flows(outfile, id1, id2, weight)
 
-# Creat a dataframe from outfile
-result_list = result[1]
-result_df = pd.DataFrame(list(result_list.items()), columns=['Points', 'Value'])
-result_df[['id1', 'id2']] = pd.DataFrame(result_df['Points'].tolist(), index=result_df.index)
-result_df = result_df[['id1', 'id2', 'Value']]
+# Creat a dataframe of the flows
+result_df = pd.DataFrame({'id1': id1, 'id2': id2, 'Value': weight})
 
 # Sort ascending or descending frequency by Value
 result_df.sort_values(by='Value', ascending=False)
@@ -229,32 +183,12 @@ import igraph as ig
 from igraph import *
 from functools import reduce # Python3
 
-# Get vertices and flow_count_dict by using count_flow function
-vertices, flow_count_dict = count_flow(infile, col1, col2, outfile)
-
-g = Graph(directed=False) # Create an undirected graph
-
-# Create lists to store edge and weight
-edge_list = []
-weight_list = []
-
-# Add the edge and weight lists
-for k, v in flow_count_dict.items():
-    edge_list.append(k)
-    weight_list.append(v)
+# Build the flow graph with one Graph(n, edges) call from the flow arrays
+from flow_graph import build_flow_graph
 
-g.add_vertices(vertices) # Add the vertices to graph
-
-# Convert zone pairs in edge_list to vertex indices in edge_list_index
-edge_list_index = []
-for pair in edge_list:
-    # Find the index of each zone in the vertices list and add the pair of indices to edge_list_index
-    edge_list_index.append((vertices.index(pair[0]),vertices.index(pair[1])))
-g.add_edges(edge_list_index)
-
-# Assign weight and label the weight
-g.es['weight'] = weight_list
-g.es['label'] = weight_list
+g = build_flow_graph(ids, id1, id2, weight)
+vertices = g.vs['name'] # zone IDs in vertex order
+weight_list = g.es['weight']
 
 # Detect community using multilevel methodology
 community = g.community_multilevel(weights = weight_list)
@@ -265,6 +199,14 @@ with open("community_weekday.txt", "w") as output: # remember to change this fil
     for i in range (len(vertices)):
         output.write(str(vertices[i]) +'\t'+ str(community.membership[i])+'\n')
 
+# The multilevel result depends on the vertex order: run 100 trials with shuffled orders and keep the consensus
+# partition, with the share of trials each kiosk stayed with its community. The kiosk graph is small, so the
+# trials run in this process (n_workers=1); pool workers would re-import this script and redo everything above
+from flow_graph import community_ensemble, write_membership
+
+consensus_membership, stability, co_assigned = community_ensemble(g, n_trials=100, n_workers=1)
+write_membership("community_weekday_consensus.txt", vertices, consensus_membership, stability)
+
 ########################################################################################################################
 
 # Accessibility
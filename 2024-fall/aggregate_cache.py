@@ -0,0 +1,184 @@
+"""
+On-disk cache for per-file aggregates (per-zone pickup counts, OD-pair counts, ...).
+
+An entry is keyed by the content of the input file and by the aggregation parameters
+(columns, filters, ...), and holds a few small NumPy arrays in an .npz file (cached_file
+keeps other values, such as a built graph, in a file of their own). The content
+hash of a file is computed once per (path, size, mtime) and remembered, so a repeated
+lookup on an unchanged file is a stat() call plus loading the .npz. The cache has a size
+cap and evicts the least recently used entries (by entry file mtime, which is touched on
+every hit).
+
+There is no shared index: every file is written under a temporary name and renamed into
+place, so several worker processes can use the same cache folder at once.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = '.aggregate_cache'
+MAX_BYTES = 512 * 1024 * 1024 # default size cap of the cache folder
+HASH_BLOCK = 8 * 1024 * 1024 # bytes read at a time when hashing a file
+
+
+def content_hash(file_name):
+    """
+    BLAKE2b digest of the whole file, read in large blocks.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def params_key(params):
+    """
+    Stable digest of the aggregation parameters (any JSON-serializable value).
+    """
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=12).hexdigest()
+
+
+class AggregateCache:
+    """
+    Size-capped LRU cache of NumPy arrays keyed by (file content, aggregation parameters).
+
+    Parameters:
+    - cache_dir: folder holding the .npz entries
+    - max_bytes: total size of the entries kept; older entries are evicted beyond it
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.files_dir = os.path.join(cache_dir, 'files') # remembered content hashes, one JSON per input path
+        os.makedirs(self.files_dir, exist_ok=True)
+
+    def _entry_file(self, key, suffix='.npz'):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def fingerprint(self, file_name):
+        """
+        Content hash of a file, reusing the remembered hash while path, size and mtime are unchanged.
+        """
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        meta_file = os.path.join(self.files_dir, params_key(path) + '.json')
+        try:
+            with open(meta_file) as f:
+                known = json.load(f)
+            if known['path'] == path and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                return known['hash']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        file_hash = content_hash(path)
+        tmp_file = f"{meta_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash}, f)
+        os.replace(tmp_file, meta_file)
+        return file_hash
+
+    def _entry_key(self, file_name, params):
+        return self.fingerprint(file_name) + '_' + params_key(params)
+
+    def get(self, file_name, params):
+        """
+        Cached arrays for this file and parameters as a {name: array} dictionary, or None.
+        """
+        entry_file = self._entry_file(self._entry_key(file_name, params))
+        try:
+            with np.load(entry_file) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(entry_file) # mark as recently used
+        except OSError:
+            return None
+        return arrays
+
+    def put(self, file_name, params, arrays):
+        """
+        Stores a {name: array} dictionary for this file and parameters, then enforces the size cap.
+        """
+        entry_file = self._entry_file(self._entry_key(file_name, params))
+        tmp_file = f"{entry_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, entry_file)
+        self._evict(self.max_bytes)
+
+    def cached(self, file_name, params, compute):
+        """
+        Returns the cached arrays, or calls compute() (which must return a {name: array} dictionary)
+        and caches its result.
+        """
+        arrays = self.get(file_name, params)
+        if arrays is None:
+            arrays = compute()
+            self.put(file_name, params, arrays)
+        return arrays
+
+    def cached_file(self, file_name, params, compute, save, load, suffix):
+        """
+        cached() for values that are not a dictionary of arrays, e.g. a built graph: the entry is
+        a file ending in suffix, written by save(value, path) and read back by load(path). It is
+        keyed, touched and evicted like the .npz entries.
+        """
+        entry_file = self._entry_file(self._entry_key(file_name, params), suffix)
+        try:
+            value = load(entry_file)
+            os.utime(entry_file) # mark as recently used
+            return value
+        except FileNotFoundError:
+            pass
+        value = compute()
+        tmp_file = f"{entry_file}.{os.getpid()}.tmp{suffix}"
+        save(value, tmp_file)
+        os.replace(tmp_file, entry_file)
+        self._evict(self.max_bytes)
+        return value
+
+    def _evict(self, max_bytes):
+        # drop least recently used entries until the total size fits under max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if '.tmp' not in name and name != os.path.basename(self.files_dir):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError: # evicted by another process meanwhile
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Removes every cached entry.
+        """
+        self._evict(-1)
+
+
+def flows_to_arrays(id_list, flow_count_dict):
+    """
+    Packs the (id_list, flow_count_dict) result of count_flow into arrays for the cache.
+    """
+    pairs = np.array(list(flow_count_dict.keys()), dtype=np.int64).reshape(-1, 2)
+    return {'ids': np.array(id_list, dtype=np.int64), 'id1': pairs[:, 0], 'id2': pairs[:, 1],
+            'weight': np.array(list(flow_count_dict.values()), dtype=np.int64)}
+
+
+def arrays_to_flows(arrays):
+    """
+    Rebuilds (id_list, flow_count_dict) from flows_to_arrays output.
+    """
+    id_list = arrays['ids'].tolist()
+    flow_count_dict = dict(zip(zip(arrays['id1'].tolist(), arrays['id2'].tolist()), arrays['weight'].tolist()))
+    return id_list, flow_count_dict
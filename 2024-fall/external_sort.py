@@ -0,0 +1,395 @@
+"""
+Out-of-core external merge sort of large CSV files by one numeric column.
+
+Sorting a trip file that does not fit in memory happens in two phases:
+
+1. Run generation: the file is read in chunks of about run_bytes (derived from a memory
+   budget, not from a fixed number of lines). The sort column of a chunk is decoded into a
+   float64 key array with pandas, the chunk is ordered with a stable argsort of the keys, and
+   the lines are spilled unchanged to a run file, with the sorted keys next to it as raw binary.
+2. Merge: the runs are merged k ways, block by block. Every run is read through a buffer of
+   lines plus the matching keys, and all buffered lines with a key below the smallest buffered
+   "last key" are merged with one stable argsort. When there are more runs than the fan-in,
+   groups of runs are merged into longer runs first (multi-pass).
+
+Lines are copied byte for byte, so the output has the same columns and delimiter as the input.
+Rows whose key is blank or not a number sort last. The sort is stable: rows with equal keys
+keep their input order. Temporary runs are removed when the sort finishes or fails. Quoted
+fields with embedded newlines are not supported, which is fine for the taxi trip files.
+
+With n_workers > 1, reading and sorting overlap: a reader thread fills chunks ahead while
+worker processes sort them and spill the runs, and the merge reads every run through a
+background prefetch of its next block.
+"""
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import closing
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+MEMORY_BUDGET = 256 * 1024 * 1024 # bytes of memory the sort may use
+MAX_FAN_IN = 64 # most runs merged at once
+IO_BUFFER = 1024 * 1024 # buffer size of every open file
+MIN_BLOCK_BYTES = 64 * 1024 # smallest merge read per run
+KEY_DTYPE = np.float64
+
+
+def decode_keys(data, column, delimiter=','):
+    """
+    Sort keys of the lines in a block of CSV data (no header): the values of one column as a
+    float64 array, with +inf for blank or non-numeric values so that those rows sort last.
+    """
+    frame = pd.read_csv(io.BytesIO(data), header=None, usecols=[column], sep=delimiter,
+                        skip_blank_lines=False, low_memory=False)
+    keys = pd.to_numeric(frame.iloc[:, 0], errors='coerce').to_numpy(KEY_DTYPE, na_value=np.nan)
+    return np.where(np.isnan(keys), np.inf, keys)
+
+
+def read_chunks(file, run_bytes):
+    """
+    Reads an open binary file in blocks of about run_bytes that end on a line boundary.
+
+    Yields:
+    - bytes ending with a newline
+    """
+    while True:
+        data = file.read(run_bytes)
+        if not data:
+            return
+        data += file.readline() # complete the last line
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        yield data
+
+
+def sort_chunk(data, column, delimiter=','):
+    """
+    Sorts one block of CSV lines by the numeric value of a column.
+
+    Returns:
+    - keys: the sorted float64 keys
+    - lines: the lines (without newline) in sorted order
+    """
+    lines = data.split(b'\n')[:-1]
+    keys = decode_keys(data, column, delimiter)
+    if len(keys) != len(lines):
+        raise ValueError("could not decode one key per line; quoted newlines are not supported")
+    order = np.argsort(keys, kind='stable')
+    return keys[order], [lines[i] for i in order]
+
+
+def write_run(path, keys, lines):
+    """
+    Writes a sorted run: the lines to path and the keys as raw binary to path + '.keys'.
+    """
+    with open(path, 'wb', buffering=IO_BUFFER) as f:
+        f.write(b'\n'.join(lines))
+        f.write(b'\n')
+    keys.astype(KEY_DTYPE, copy=False).tofile(path + '.keys')
+
+
+def _spill_run(data, path, column, delimiter):
+    # worker task: sort one chunk and write it as a run; returns the path and the seconds spent
+    start = time.perf_counter()
+    write_run(path, *sort_chunk(data, column, delimiter))
+    return path, time.perf_counter() - start
+
+
+def _timed(iterable, timings, name):
+    # adds the time spent producing every item of iterable to timings[name]
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        yield item
+
+
+def prefetch(iterable, depth):
+    """
+    Iterates over iterable in a background thread, keeping up to depth items ready.
+
+    When the consumer stops early (an error, or the generator is closed), the thread is told to
+    stop and the queue is drained until it has finished, so it does not stay blocked on a full
+    queue or keep reading from a file that is about to be closed.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def fill():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except BaseException as error: # handed to the consumer
+            items.put(error)
+            return
+        items.put(done)
+
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive(): # unblock a pending put until the thread sees the stop flag
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+def generate_runs(file, run_dir, column, run_bytes, delimiter=',', n_workers=1, timings=None):
+    """
+    Splits an open binary file (positioned after the header) into sorted runs in run_dir.
+
+    With n_workers > 1 a reader thread reads the next chunks while a process pool sorts and
+    spills the previous ones; at most n_workers chunks are read ahead and n_workers are in the
+    pool, which bounds the memory in use.
+
+    Parameters:
+    - timings: optional dictionary; the seconds spent reading chunks are added to 'split' and the
+      seconds spent sorting and spilling them (summed over the workers) to 'sort'
+
+    Returns:
+    - run paths in input order
+    """
+    timings = {} if timings is None else timings
+    chunks = _timed(read_chunks(file, run_bytes), timings, 'split')
+    paths = (os.path.join(run_dir, f"run_{k:06d}") for k in count())
+    if n_workers <= 1:
+        results = [_spill_run(data, path, column, delimiter) for data, path in zip(chunks, paths)]
+    else:
+        results = []
+        in_flight = deque()
+        with Pool(n_workers) as pool, closing(prefetch(chunks, n_workers)) as ahead:
+            for data, path in zip(ahead, paths):
+                in_flight.append(pool.apply_async(_spill_run, (data, path, column, delimiter)))
+                if len(in_flight) >= n_workers:
+                    results.append(in_flight.popleft().get())
+            results.extend(result.get() for result in in_flight)
+    timings['sort'] = timings.get('sort', 0.0) + sum(seconds for path, seconds in results)
+    return [path for path, seconds in results]
+
+
+def _run_size(path):
+    return os.path.getsize(path) + os.path.getsize(path + '.keys')
+
+
+def _remove_run(path):
+    os.remove(path)
+    os.remove(path + '.keys')
+
+
+class RunReader:
+    """
+    Buffered reader of one sorted run: keys holds the buffered keys and lines the matching lines.
+    """
+
+    def __init__(self, path, block_bytes, executor=None):
+        self.file = open(path, 'rb', buffering=IO_BUFFER)
+        self.executor = executor # reads the next block in the background when given
+        self.ahead = None
+        self.all_keys = np.memmap(path + '.keys', dtype=KEY_DTYPE, mode='r') # runs are never empty
+        self.block_bytes = block_bytes
+        self.next_key = 0 # index in all_keys of the first line not buffered yet
+        self.tail = b''
+        self.keys = np.empty(0, dtype=KEY_DTYPE)
+        self.lines = []
+        self.exhausted = False
+        self.extend()
+
+    def extend(self):
+        """
+        Appends the next block of the run to the buffer.
+        """
+        data = self.tail + self._read_block()
+        lines = data.split(b'\n')
+        self.tail = lines.pop() # partial line, completed by the next read
+        if not lines and self.tail:
+            return self.extend()
+        end = self.next_key + len(lines)
+        self.keys = np.concatenate([self.keys, self.all_keys[self.next_key:end]])
+        self.lines.extend(lines)
+        self.next_key = end
+        self.exhausted = end == len(self.all_keys)
+
+    def _read_block(self):
+        if self.executor is None:
+            return self.file.read(self.block_bytes)
+        if self.ahead is None:
+            self.ahead = self.executor.submit(self.file.read, self.block_bytes)
+        data = self.ahead.result()
+        self.ahead = self.executor.submit(self.file.read, self.block_bytes) if data else None
+        return data
+
+    def consume(self, n):
+        """
+        Drops the first n buffered lines, reading the next block when the buffer runs empty.
+        """
+        self.keys = self.keys[n:]
+        del self.lines[:n]
+        if not self.lines and not self.exhausted:
+            self.extend()
+
+    def close(self):
+        if self.ahead is not None:
+            self.ahead.result() # let a running read finish before the file is closed
+        self.file.close()
+        del self.all_keys # release the memory map before the run is removed
+
+
+def merge_runs(run_paths, out_file, block_bytes, key_file=None, prefetch_runs=False):
+    """
+    Stable k-way merge of sorted runs into out_file (an open binary file).
+
+    Every step takes, from every run, the buffered lines whose key is below the smallest last
+    buffered key of the runs that still have unread lines; no unread line can sort before
+    those. The taken lines are ordered with one stable argsort on their keys (runs in input
+    order), so equal keys keep the order of the runs.
+
+    Parameters:
+    - run_paths: runs written by write_run, in input order
+    - out_file: open binary file receiving the merged lines
+    - block_bytes: bytes read per run and block
+    - key_file: optional open binary file receiving the merged keys (for an intermediate run)
+    - prefetch_runs: read the next block of every run in background threads while merging
+
+    Returns:
+    - number of lines written
+    """
+    executor = ThreadPoolExecutor(min(len(run_paths), 16)) if prefetch_runs and run_paths else None
+    readers = [RunReader(path, block_bytes, executor) for path in run_paths]
+    written = 0
+    try:
+        active = [reader for reader in readers if reader.lines]
+        while active:
+            pending = [reader for reader in active if not reader.exhausted]
+            if pending:
+                limiter = min(pending, key=lambda reader: reader.keys[-1])
+                cutoff = limiter.keys[-1]
+                takes = [int(np.searchsorted(reader.keys, cutoff, side='left')) for reader in active]
+                if not any(takes):
+                    # every buffered key is >= cutoff, so the limiting run holds only that key: read further
+                    limiter.extend()
+                    continue
+            else:
+                takes = [len(reader.lines) for reader in active]
+
+            keys = np.concatenate([reader.keys[:take] for reader, take in zip(active, takes)])
+            lines = [line for reader, take in zip(active, takes) for line in reader.lines[:take]]
+            order = np.argsort(keys, kind='stable')
+            out_file.write(b'\n'.join([lines[i] for i in order]))
+            out_file.write(b'\n')
+            if key_file is not None:
+                keys[order].tofile(key_file)
+            written += len(lines)
+            for reader, take in zip(active, takes):
+                reader.consume(take)
+            active = [reader for reader in active if reader.lines]
+    finally:
+        for reader in readers:
+            reader.close()
+        if executor is not None:
+            executor.shutdown()
+    return written
+
+
+def external_sort(infile, outfile, column, memory_budget=MEMORY_BUDGET, fan_in=MAX_FAN_IN, tmp_dir=None,
+                  header=True, delimiter=',', n_workers=1):
+    """
+    Sorts a CSV file by the numeric value of one column without loading it into memory.
+
+    Parameters:
+    - infile: CSV file to sort
+    - outfile: sorted output file
+    - column: position of the sort column, e.g. 7 for PULocationID in yellow_tripdata files
+    - memory_budget: bytes of memory to use; a run holds about a quarter of it (lines, keys,
+      the sort order and the output copy take the rest), or an equal share of that between the
+      chunks in the workers and the chunks read ahead when n_workers > 1
+    - fan_in: most runs merged at once; more runs are merged in several passes
+    - tmp_dir: folder for the temporary runs, by default next to outfile
+    - header: infile has a header line; it is copied to the top of outfile
+    - delimiter: field delimiter
+    - n_workers: processes sorting runs in parallel (None for all cores); above 1 the merge also
+      prefetches its reads
+
+    Returns:
+    - {'rows': number of sorted rows, 'runs': number of initial runs, 'merge_passes': number of
+      merge passes including the final one, 'timings': seconds per phase ('split': reading chunks,
+      'sort': sorting and spilling runs, summed over the workers, 'run_generation': wall-clock time
+      of both, 'merge': all merge passes), 'bytes_read' and 'bytes_written': file I/O of the sort}
+    """
+    if fan_in < 2:
+        raise ValueError("fan_in must be at least 2")
+    n_workers = max(1, n_workers or os.cpu_count())
+    chunks_alive = 1 if n_workers == 1 else 2 * n_workers # chunks read ahead or in the pool at once
+    run_bytes = max(memory_budget // (4 * chunks_alive), MIN_BLOCK_BYTES)
+    block_bytes = max(memory_budget // (4 * fan_in), MIN_BLOCK_BYTES)
+    prefetch_runs = n_workers > 1
+    run_dir = tempfile.mkdtemp(prefix='sort_runs_', dir=tmp_dir or os.path.dirname(os.path.abspath(outfile)))
+    try:
+        # 1. run generation
+        timings = {}
+        start = time.perf_counter()
+        with open(infile, 'rb', buffering=IO_BUFFER) as f:
+            header_line = f.readline() if header else b''
+            runs = generate_runs(f, run_dir, column, run_bytes, delimiter, n_workers, timings)
+        timings['run_generation'] = time.perf_counter() - start
+        n_runs = len(runs)
+        bytes_read = os.path.getsize(infile)
+        bytes_written = sum(_run_size(run) for run in runs)
+
+        # 2. intermediate merge passes while there are more runs than the fan-in
+        start = time.perf_counter()
+        passes = 0
+        while len(runs) > fan_in:
+            merged = []
+            for first in range(0, len(runs), fan_in):
+                group = runs[first:first + fan_in]
+                path = os.path.join(run_dir, f"pass{passes}_{len(merged):06d}")
+                with open(path, 'wb', buffering=IO_BUFFER) as out, open(path + '.keys', 'wb') as key_file:
+                    merge_runs(group, out, block_bytes, key_file, prefetch_runs)
+                bytes_read += sum(_run_size(run) for run in group)
+                bytes_written += _run_size(path)
+                for run in group:
+                    _remove_run(run)
+                merged.append(path)
+            runs = merged
+            passes += 1
+
+        # 3. final merge
+        with open(outfile, 'wb', buffering=IO_BUFFER) as out:
+            if header_line:
+                out.write(header_line if header_line.endswith(b'\n') else header_line + b'\n')
+            rows = merge_runs(runs, out, block_bytes, prefetch_runs=prefetch_runs)
+        timings['merge'] = time.perf_counter() - start
+        bytes_read += sum(_run_size(run) for run in runs)
+        bytes_written += os.path.getsize(outfile)
+        return {'rows': rows, 'runs': n_runs, 'merge_passes': passes + 1, 'timings': timings,
+                'bytes_read': bytes_read, 'bytes_written': bytes_written}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
@@ -0,0 +1,553 @@
+"""
+Derive an undirected flow network (zone pair -> number of trips) from a trip CSV file.
+
+count_flow registers zone IDs in a ZoneIndex, a hashed zone ID -> vertex index map, so checking
+whether a zone was seen is O(1) per lookup; its ids are the id_list, which is also the vertex
+order of flow_graph.build_flow_graph.
+
+flow_matrix is the vectorized version: the two zone columns are read as integer arrays and
+the pairs are counted with NumPy, returning the same (id_list, flow_count_dict) plus a sparse
+matrix of the counts.
+
+Both are silent: pass a FlowStats to get the number of skipped self-loops, blank and malformed
+rows and the time spent per stage, and a progress callback (e.g. progress_printer()) for
+throttled progress reports.
+
+sharded_flow_matrix splits one large file (or many monthly files) into line-aligned byte
+ranges, counts every range in a worker process and merges the partial counts.
+
+Counted flows are saved as flow tables: an .npz file of id1/id2/weight columns (plus the zone
+list) that loads without parsing, or the count_flow text format. open_flows keeps the counts of a
+trip file in an AggregateCache, keyed by the file content and the zone columns, and only counts
+again when the content changed.
+"""
+import io
+import os
+import time
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from aggregate_cache import AggregateCache
+
+CHUNK_ROWS = 1_000_000
+FLOW_ARRAYS = ('ids', 'id1', 'id2', 'weight') # names of the flow arrays in a flow table / cache entry
+SHARD_BYTES = 256 * 1024 * 1024 # largest byte range a worker reads into memory at once
+
+
+class ZoneIndex:
+    """
+    Maps zone IDs to consecutive vertex indices in order of first appearance.
+
+    ids is the list of zone IDs (the id_list returned by count_flow, and the vertex order of the graph);
+    position(zone_id) is the vertex index of a zone.
+    """
+
+    def __init__(self, ids=()):
+        self.ids = []
+        self.positions = {}
+        for zone_id in ids:
+            self.add(zone_id)
+
+    def add(self, zone_id):
+        """
+        Registers zone_id if it is new and returns its vertex index.
+        """
+        position = self.positions.get(zone_id)
+        if position is None:
+            position = self.positions[zone_id] = len(self.ids)
+            self.ids.append(zone_id)
+        return position
+
+    def position(self, zone_id):
+        return self.positions[zone_id]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, zone_id):
+        return zone_id in self.positions
+
+
+class FlowStats:
+    """
+    Counters and per-stage timings of a flow extraction run.
+
+    rows: data rows read; pairs: rows counted as a flow; self_loops: rows with the same origin and
+    destination; blank: rows with an empty or missing zone value; malformed: rows whose zone values
+    could not be parsed. timings maps a stage name ('parse', 'count', 'write', ...) to seconds.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.pairs = 0
+        self.self_loops = 0
+        self.blank = 0
+        self.malformed = 0
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Adds the wall-clock time of the with-block to timings[name].
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, other):
+        """
+        Adds the counters and timings of another run (e.g. a worker's shard) to this one.
+        """
+        for name in ('rows', 'pairs', 'self_loops', 'blank', 'malformed'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, seconds in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        return self
+
+    def summary(self):
+        stages = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+        return (f"{self.rows} rows: {self.pairs} flows, {self.self_loops} self-loops, "
+                f"{self.blank} blank, {self.malformed} malformed ({stages})")
+
+
+def progress_printer(min_seconds=5.0):
+    """
+    Progress callback for count_flow / flow_matrix that prints the row count at most every min_seconds.
+    """
+    last = [float('-inf')]
+
+    def report(stats):
+        now = time.perf_counter()
+        if now - last[0] >= min_seconds:
+            last[0] = now
+            print(f"{stats.rows} rows processed")
+    return report
+
+
+def _parse_zone(text):
+    # zone IDs are usually plain integers; files written by pandas may hold "2.0"
+    try:
+        return int(text)
+    except ValueError:
+        return int(float(text))
+
+
+def count_flow(infile, col1, col2, outfile, zone_index=None, progress=None, progress_every=100_000, stats=None,
+               batch_rows=100_000):
+    flow_count_dict = {} # Create a dictionary to store counts of flows between zone pairs
+    zone_index = ZoneIndex() if zone_index is None else zone_index # Hashed zone ID -> vertex index
+    id_list = zone_index.ids # Unique zone IDs in order of first appearance
+    stats = FlowStats() if stats is None else stats # Counters for skipped rows and stage timings
+
+    with open(infile) as bigfile: # Open file
+        bigfile.readline() # Skip the header
+        while True:
+            # Parse the next batch_rows lines into zone pairs, so parsing and counting are timed separately
+            with stats.stage('parse'):
+                lines = list(islice(bigfile, batch_rows))
+                zone_pairs = []
+                for line in lines:
+                    stats.rows += 1
+                    # Call the progress hook every progress_every rows (the loop itself prints nothing)
+                    if progress is not None and stats.rows % progress_every == 0:
+                        progress(stats)
+
+                    # Split the line once and get the zone1_id and zone2_id; count and skip blank or malformed rows
+                    fields = line.rstrip('\n').split(',')
+                    zone1_text = fields[col1].strip() if col1 < len(fields) else ''
+                    zone2_text = fields[col2].strip() if col2 < len(fields) else ''
+                    if zone1_text == '' or zone2_text == '':
+                        stats.blank += 1
+                        continue
+                    try:
+                        zone1_id = _parse_zone(zone1_text)
+                        zone2_id = _parse_zone(zone2_text)
+                    except ValueError:
+                        stats.malformed += 1
+                        continue
+
+                    # Skip if the zone1_id and zone2_id are the same
+                    if zone1_id == zone2_id:
+                        stats.self_loops += 1
+                        continue
+                    zone_pairs.append((zone1_id, zone2_id))
+            if not lines:
+                break
+
+            with stats.stage('count'):
+                for zone1_id, zone2_id in zone_pairs:
+                    # Add zone1_id and zone2_id to the zone index if they aren't already present (O(1) dict lookups)
+                    zone_index.add(zone1_id)
+                    zone_index.add(zone2_id)
+
+                    # Create pairs of zone1 and zone2
+                    zone_pair = (zone1_id, zone2_id)
+                    zone_pair_reverse = (zone2_id, zone1_id)
+
+                    # Add the flow count for each zone pair
+                    if zone_pair in flow_count_dict:
+                        flow_count_dict[zone_pair] += 1
+                    elif zone_pair_reverse in flow_count_dict:
+                        flow_count_dict[zone_pair_reverse] += 1
+                    else:
+                        flow_count_dict[zone_pair] = 1 # Assign 1 if the zone pair doesn't exist
+                stats.pairs += len(zone_pairs)
+
+    # Export outfile
+    with stats.stage('write'), open(outfile, "w") as output:
+        for k, v in flow_count_dict.items():
+            output.write(str(k) + '\t' + str(v) + '\n')
+    return id_list, flow_count_dict
+
+
+def read_zone_pairs(infile, col1, col2, chunk_rows=CHUNK_ROWS, stats=None, progress=None, header='infer'):
+    """
+    Reads the two zone columns (by position) of a trip CSV as int64 arrays, chunk by chunk.
+    Rows with a blank or non-numeric value in either column are counted in stats and dropped;
+    progress(stats) is called after every chunk. infile may be a file object; header=None
+    reads data without a header line (a shard of a file).
+    """
+    stats = FlowStats() if stats is None else stats
+    zone1_chunks = []
+    zone2_chunks = []
+    # pandas parses clean numeric columns in C (blank cells become NaN); only the rows that fail
+    # to_numeric are looked at as text, to tell blank cells from malformed ones. IDs written as
+    # "2.0" are accepted.
+    reader = pd.read_csv(infile, usecols=[col1, col2], header=header, chunksize=chunk_rows)
+    first, second = (0, 1) if col1 < col2 else (1, 0) # usecols keeps the columns in file order
+    for chunk in reader:
+        values = chunk.apply(pd.to_numeric, errors='coerce')
+        good = values.notna().all(axis=1).to_numpy()
+        blank = chunk.isna().to_numpy() # whitespace-only cells count as blank, like in count_flow
+        failed = ~good
+        if failed.any():
+            blank[failed] |= chunk[failed].apply(lambda column: column.astype(str).str.strip() == '').to_numpy()
+        blank = blank.any(axis=1)
+        bad = failed & ~blank
+        stats.rows += len(chunk)
+        stats.blank += int(blank.sum())
+        stats.malformed += int(bad.sum())
+        zone1_chunks.append(values.iloc[:, first].to_numpy()[good].astype(np.int64))
+        zone2_chunks.append(values.iloc[:, second].to_numpy()[good].astype(np.int64))
+        if progress is not None:
+            progress(stats)
+    if not zone1_chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(zone1_chunks), np.concatenate(zone2_chunks)
+
+
+def count_pairs(zone1, zone2):
+    """
+    Counts undirected zone pairs from two zone ID arrays, dropping self-loops.
+
+    Pairs are canonicalized with np.minimum/np.maximum and counted with np.unique. The result
+    matches count_flow: zones and pairs are listed in order of first appearance, and each pair
+    keeps the orientation in which it first appeared.
+
+    Returns:
+    - ids: zone IDs in order of first appearance (the id_list of count_flow)
+    - id1, id2, weight: one entry per undirected pair
+    """
+    keep = zone1 != zone2 # drop self-loops with a mask
+    zone1 = zone1[keep]
+    zone2 = zone2[keep]
+
+    # zones in order of first appearance (zone1 before zone2 within a row, like count_flow)
+    interleaved = np.column_stack([zone1, zone2]).ravel()
+    unique_ids, first_seen = np.unique(interleaved, return_index=True)
+    ids = unique_ids[np.argsort(first_seen)]
+
+    low = np.minimum(zone1, zone2)
+    high = np.maximum(zone1, zone2)
+    key = low * (int(high.max(initial=0)) + 1) + high # one integer per undirected pair
+    unique_keys, first_row, weight = np.unique(key, return_index=True, return_counts=True)
+    order = np.argsort(first_row)
+    first_row = first_row[order]
+    return ids, zone1[first_row], zone2[first_row], weight[order]
+
+
+def pairs_to_matrix(id1, id2, weight, n_zones=None):
+    """
+    Sparse CSR matrix of pair counts indexed by zone ID, one triangle only: matrix[min, max] = count.
+    """
+    low = np.minimum(id1, id2)
+    high = np.maximum(id1, id2)
+    size = n_zones if n_zones is not None else int(high.max(initial=-1)) + 1
+    return sparse.coo_matrix((weight, (low, high)), shape=(size, size)).tocsr()
+
+
+def write_flows(outfile, id1, id2, weight):
+    """
+    Writes flows in the count_flow text format, e.g. "(74, 75)\t3036".
+    """
+    with open(outfile, "w") as output:
+        output.writelines(f"({a}, {b})\t{w}\n" for a, b, w in zip(id1.tolist(), id2.tolist(), weight.tolist()))
+
+
+def flow_arrays(infile, col1, col2, chunk_rows=CHUNK_ROWS, stats=None, progress=None):
+    """
+    Reads and counts the zone pairs of a trip CSV; the array part of flow_matrix.
+
+    Returns:
+    - ids, id1, id2, weight (see count_pairs)
+    """
+    stats = FlowStats() if stats is None else stats
+    with stats.stage('parse'):
+        zone1, zone2 = read_zone_pairs(infile, col1, col2, chunk_rows, stats, progress)
+    with stats.stage('count'):
+        stats.self_loops += int((zone1 == zone2).sum())
+        stats.pairs += int((zone1 != zone2).sum())
+        return count_pairs(zone1, zone2)
+
+
+def flow_matrix(infile, col1, col2, outfile=None, chunk_rows=CHUNK_ROWS, stats=None, progress=None):
+    """
+    Vectorized count_flow.
+
+    Parameters:
+    - infile: trip CSV file with a header
+    - col1, col2: positions of the origin and destination zone columns
+    - outfile: optional flow table (see write_flow_table): .npz for the columnar format, any other
+      name for the count_flow text format
+    - chunk_rows: rows parsed per chunk
+    - stats: optional FlowStats filled with row counters and 'parse', 'count', 'write' timings
+    - progress: optional callback progress(stats), called after every chunk (see progress_printer)
+
+    Returns:
+    - id_list, flow_count_dict: the same contract as count_flow
+    - matrix: scipy.sparse CSR matrix of the counts (see pairs_to_matrix)
+    """
+    stats = FlowStats() if stats is None else stats
+    ids, id1, id2, weight = flow_arrays(infile, col1, col2, chunk_rows, stats, progress)
+    if outfile:
+        with stats.stage('write'):
+            write_flow_table(outfile, ids, id1, id2, weight)
+    return arrays_to_result(ids, id1, id2, weight)
+
+
+def arrays_to_result(ids, id1, id2, weight):
+    """
+    The (id_list, flow_count_dict, matrix) result of flow_matrix from flow arrays.
+    """
+    flow_count_dict = dict(zip(zip(id1.tolist(), id2.tolist()), weight.tolist()))
+    return ids.tolist(), flow_count_dict, pairs_to_matrix(id1, id2, weight)
+
+
+# ----------------------------
+# Sharded counting
+# ----------------------------
+
+def byte_shards(infile, n_shards):
+    """
+    Splits the data lines of a CSV file (everything after the header) into about n_shards
+    byte ranges that start and end on line boundaries.
+
+    Returns:
+    - list of (infile, start, end) byte ranges, in file order
+    """
+    size = os.path.getsize(infile)
+    with open(infile, 'rb') as f:
+        f.readline() # the header is not part of any shard
+        bounds = [f.tell()]
+        for k in range(1, n_shards):
+            target = bounds[0] + (size - bounds[0]) * k // n_shards
+            if target <= bounds[-1]:
+                continue
+            f.seek(target)
+            f.readline() # move to the start of the next line
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [(infile, start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _count_shard(shard, col1, col2, chunk_rows):
+    # one worker task: the partial counts of one byte range
+    infile, start, end = shard
+    stats = FlowStats()
+    with open(infile, 'rb') as f:
+        f.seek(start)
+        data = io.BytesIO(f.read(end - start))
+    with stats.stage('parse'):
+        zone1, zone2 = read_zone_pairs(data, col1, col2, chunk_rows, stats, header=None)
+    with stats.stage('count'):
+        stats.self_loops += int((zone1 == zone2).sum())
+        stats.pairs += int((zone1 != zone2).sum())
+        partial_counts = count_pairs(zone1, zone2)
+    return partial_counts, stats
+
+
+def merge_pair_counts(parts):
+    """
+    Merges partial count_pairs results of consecutive pieces of the data, given in data order.
+
+    Zones and pairs keep the order and orientation of their first appearance in the whole data,
+    so the result equals count_pairs over the concatenated pieces.
+
+    Returns:
+    - ids, id1, id2, weight (see count_pairs)
+    """
+    parts = list(parts)
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    ids = np.concatenate([part[0] for part in parts])
+    unique_ids, first_seen = np.unique(ids, return_index=True)
+    ids = unique_ids[np.argsort(first_seen)]
+
+    id1 = np.concatenate([part[1] for part in parts])
+    id2 = np.concatenate([part[2] for part in parts])
+    weight = np.concatenate([part[3] for part in parts])
+    low = np.minimum(id1, id2)
+    high = np.maximum(id1, id2)
+    key = low * (int(high.max(initial=0)) + 1) + high
+    unique_keys, first_row, inverse = np.unique(key, return_index=True, return_inverse=True)
+    total = np.bincount(inverse.ravel(), weights=weight, minlength=len(unique_keys)).astype(np.int64)
+    order = np.argsort(first_row)
+    first_row = first_row[order]
+    return ids, id1[first_row], id2[first_row], total[order]
+
+
+def sharded_flow_matrix(infiles, col1, col2, outfile=None, n_workers=None, shard_bytes=SHARD_BYTES,
+                        chunk_rows=CHUNK_ROWS, stats=None):
+    """
+    flow_matrix for one large trip file or many monthly files, counted in worker processes.
+
+    Every file is cut into byte ranges aligned to line boundaries (see byte_shards); each worker
+    parses and counts one range into a small partial result (one entry per distinct pair), and
+    the partials are merged in file order (see merge_pair_counts). Quoted fields with embedded
+    newlines are not supported, which is fine for the taxi and MetroBike trip files.
+
+    Parameters:
+    - infiles: a trip CSV file name or a list of them (all with the same columns and a header)
+    - col1, col2: positions of the origin and destination zone columns
+    - outfile: optional flow table (see write_flow_table)
+    - n_workers: number of processes, defaults to os.cpu_count()
+    - shard_bytes: largest byte range per task; bounds the memory of every worker
+    - stats: optional FlowStats; the workers' counters and parse/count times (summed over the
+      workers) are added to it, plus the wall-clock 'shards', 'merge' and 'write' times
+
+    Returns:
+    - id_list, flow_count_dict, matrix: the same result as flow_matrix over the files in order
+    """
+    if isinstance(infiles, str):
+        infiles = [infiles]
+    stats = FlowStats() if stats is None else stats
+    n_workers = n_workers or os.cpu_count()
+    shards = []
+    for infile in infiles:
+        n_shards = max(n_workers, -(-os.path.getsize(infile) // shard_bytes))
+        shards.extend(byte_shards(infile, n_shards))
+
+    task = partial(_count_shard, col1=col1, col2=col2, chunk_rows=chunk_rows)
+    with stats.stage('shards'):
+        if n_workers > 1 and len(shards) > 1:
+            with Pool(min(n_workers, len(shards))) as pool:
+                results = pool.map(task, shards) # results keep the order of the shards
+        else:
+            results = [task(shard) for shard in shards]
+
+    for partial_counts, shard_stats in results:
+        stats.merge(shard_stats)
+    with stats.stage('merge'):
+        ids, id1, id2, weight = merge_pair_counts(partial_counts for partial_counts, shard_stats in results)
+    if outfile:
+        with stats.stage('write'):
+            write_flow_table(outfile, ids, id1, id2, weight)
+    return arrays_to_result(ids, id1, id2, weight)
+
+
+# ----------------------------
+# Flow tables
+# ----------------------------
+
+def write_flow_table(outfile, ids, id1, id2, weight):
+    """
+    Saves counted flows.
+
+    A name ending in .npz stores the zone list and the id1/id2/weight columns as binary NumPy
+    arrays, which read_flow_table loads without any text parsing; any other name is written in
+    the count_flow text format (see write_flows).
+    """
+    if outfile.endswith('.npz'):
+        np.savez(outfile, ids=np.asarray(ids, dtype=np.int64), id1=np.asarray(id1, dtype=np.int64),
+                 id2=np.asarray(id2, dtype=np.int64), weight=np.asarray(weight, dtype=np.int64))
+    else:
+        write_flows(outfile, id1, id2, weight)
+
+
+def read_flow_table(infile):
+    """
+    Loads a flow table written by write_flow_table (or by count_flow).
+
+    Returns:
+    - ids, id1, id2, weight (see count_pairs)
+    """
+    if infile.endswith('.npz'):
+        with np.load(infile) as data:
+            return data['ids'], data['id1'], data['id2'], data['weight']
+
+    table = pd.read_csv(infile, sep='\t', header=None, names=['pair', 'weight'])
+    if len(table) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    pair = table['pair'].str.strip('()').str.split(',', expand=True)
+    id1 = pair[0].astype(np.int64).to_numpy()
+    id2 = pair[1].astype(np.int64).to_numpy()
+    # pairs are listed in order of first appearance, so the zones of the pairs in that order
+    # come in the order of first appearance too (the id_list of count_flow)
+    interleaved = np.column_stack([id1, id2]).ravel()
+    unique_ids, first_seen = np.unique(interleaved, return_index=True)
+    return unique_ids[np.argsort(first_seen)], id1, id2, table['weight'].to_numpy(np.int64)
+
+
+def load_flows(infile):
+    """
+    The (id_list, flow_count_dict, matrix) result of flow_matrix from a saved flow table.
+    """
+    return arrays_to_result(*read_flow_table(infile))
+
+
+def open_flow_table(infile, col1, col2, cache=None, outfile=None, stats=None, progress=None):
+    """
+    The counted flows of a trip CSV, kept in an aggregate_cache.AggregateCache under the content
+    hash of the CSV and the zone columns. The CSV is only parsed when no entry matches, so a file
+    that is rewritten with the same content (or touched) is not counted again.
+
+    Parameters:
+    - infile, col1, col2: trip CSV file and zone columns, as for flow_matrix
+    - cache: AggregateCache holding the flows, by default one in aggregate_cache.CACHE_DIR
+    - outfile: optional flow table (see write_flow_table), written from the flows on every call
+    - stats, progress: see flow_matrix; the parse and count stages only run when the flows are counted
+
+    Returns:
+    - ids, id1, id2, weight (see count_pairs)
+    """
+    cache = AggregateCache() if cache is None else cache
+    stats = FlowStats() if stats is None else stats
+
+    def count():
+        return dict(zip(FLOW_ARRAYS, flow_arrays(infile, col1, col2, stats=stats, progress=progress)))
+
+    # the same entry as the count_flow cache of 7361_HW6_communityDetection.py Task 1
+    arrays = cache.cached(infile, {'kind': 'count_flow', 'col1': col1, 'col2': col2}, count)
+    arrays = tuple(arrays[name] for name in FLOW_ARRAYS)
+    if outfile:
+        with stats.stage('write'):
+            write_flow_table(outfile, *arrays)
+    return arrays
+
+
+def open_flows(infile, col1, col2, cache=None, outfile=None, stats=None, progress=None):
+    """
+    open_flow_table returning the (id_list, flow_count_dict, matrix) result of flow_matrix.
+    """
+    return arrays_to_result(*open_flow_table(infile, col1, col2, cache, outfile, stats, progress))
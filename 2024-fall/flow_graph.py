@@ -0,0 +1,309 @@
+"""
+igraph flow networks built straight from flow arrays.
+
+The (ids, id1, id2, weight) arrays of extract_flows (count_pairs, flow tables) are turned into
+vertex index pairs with NumPy and passed to a single Graph(n, edges) call, with the weights set
+in one attribute assignment, instead of appending edges pair by pair. A built graph is kept in the
+aggregate cache under the content hash of the trip file, so repeated community detection runs
+neither count nor build again.
+
+Community detection can also be refined incrementally: the previous membership (a
+community_may.txt-style file) seeds Leiden after the weight changes of a delta of flows
+(e.g. one more day of trips) are applied to the graph.
+
+community_ensemble runs many Louvain/Leiden trials with shuffled vertex orders on a process
+pool and combines them into a consensus partition with a stability score per zone.
+"""
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from igraph import Graph
+from scipy import sparse
+
+from aggregate_cache import AggregateCache
+from extract_flows import open_flow_table
+
+GRAPH_SUFFIX = '.graph.pkl.gz' # saved graphs in the aggregate cache (gzipped pickles, see save_graph)
+
+
+def vertex_indices(ids, zones):
+    """
+    Vertex index of every zone in zones, where vertex k is the zone ids[k].
+    """
+    ids = np.asarray(ids)
+    order = np.argsort(ids, kind='stable')
+    return order[np.searchsorted(ids, zones, sorter=order)]
+
+
+def build_flow_graph(ids, id1, id2, weight):
+    """
+    Undirected weighted graph of flows.
+
+    Vertices follow ids (the id_list of count_flow) and carry the zone ID as 'name', like
+    g.add_vertices(vertices) in the scripts; edge k is the pair (id1[k], id2[k]) with 'weight'
+    (and 'label') weight[k].
+    """
+    edges = np.column_stack([vertex_indices(ids, id1), vertex_indices(ids, id2)])
+    g = Graph(n=len(ids), edges=edges.tolist(), directed=False)
+    g.vs['name'] = np.asarray(ids).tolist()
+    weights = np.asarray(weight).tolist()
+    g.es['weight'] = weights
+    g.es['label'] = weights
+    return g
+
+
+def save_graph(g, graph_file):
+    """
+    Saves a graph: GraphML for a .graphml name, otherwise a gzipped pickle (fastest to load back).
+    """
+    if graph_file.endswith('.graphml'):
+        g.write_graphml(graph_file)
+    else:
+        g.write_picklez(graph_file)
+
+
+def load_graph(graph_file):
+    """
+    Loads a graph written by save_graph.
+    """
+    if graph_file.endswith('.graphml'):
+        g = Graph.Read_GraphML(graph_file)
+        g.vs['name'] = [int(name) for name in g.vs['name']] # GraphML keeps vertex names as text
+        return g
+    return Graph.Read_Picklez(graph_file)
+
+
+def open_flow_graph(infile, col1, col2, cache=None, outfile=None, stats=None, progress=None):
+    """
+    The flow graph of a trip CSV, kept in an aggregate_cache.AggregateCache like its flows: the
+    saved graph is keyed by the content hash of the CSV (AggregateCache.fingerprint) and the zone
+    columns, so it is reused until the content changes. On a miss the flows are taken from the
+    cache (see extract_flows.open_flow_table), the graph is built in bulk and saved.
+
+    Parameters:
+    - infile, col1, col2: trip CSV file and zone columns
+    - cache: AggregateCache, by default one in aggregate_cache.CACHE_DIR
+    - outfile, stats, progress: see extract_flows.open_flow_table
+
+    Returns:
+    - igraph.Graph (see build_flow_graph)
+    """
+    cache = AggregateCache() if cache is None else cache
+
+    def build():
+        return build_flow_graph(*open_flow_table(infile, col1, col2, cache, stats=stats, progress=progress))
+
+    g = cache.cached_file(infile, {'kind': 'flow_graph', 'col1': col1, 'col2': col2}, build, save_graph, load_graph,
+                          GRAPH_SUFFIX)
+    if outfile: # written from the cached flows
+        open_flow_table(infile, col1, col2, cache, outfile, stats, progress)
+    return g
+
+
+def write_membership(outfile, names, membership, stability=None):
+    """
+    Writes "zone_id\\tcommunity" lines, the format of community_may.txt, with a third
+    stability column when stability scores are given (see community_ensemble).
+    """
+    with open(outfile, "w") as output:
+        if stability is None:
+            output.writelines(f"{name}\t{m}\n" for name, m in zip(names, membership))
+        else:
+            output.writelines(f"{name}\t{m}\t{p}\n" for name, m, p in zip(names, membership, stability))
+
+
+# ----------------------------
+# Incremental communities
+# ----------------------------
+
+def read_membership(infile):
+    """
+    Reads a "zone_id\\tcommunity" file (see write_membership) as a {zone_id: community} dictionary.
+    """
+    membership = {}
+    with open(infile) as f:
+        for line in f:
+            if line.strip():
+                zone_id, community = line.split('\t')[:2]
+                membership[int(zone_id)] = int(community)
+    return membership
+
+
+def flow_delta(old_flows, new_flows):
+    """
+    Weight changes between two sets of flows, each given as (ids, id1, id2, weight) arrays
+    (see extract_flows.read_flow_table). Pairs are compared undirected.
+
+    Returns:
+    - id1, id2, change: the pairs whose weight differs and new weight - old weight
+      (a pair missing from old_flows or new_flows has weight 0 there)
+    """
+    id1 = np.concatenate([old_flows[1], new_flows[1]])
+    id2 = np.concatenate([old_flows[2], new_flows[2]])
+    change = np.concatenate([-np.asarray(old_flows[3]), np.asarray(new_flows[3])])
+    low = np.minimum(id1, id2)
+    high = np.maximum(id1, id2)
+    key = low * (int(high.max(initial=0)) + 1) + high
+    unique_keys, first_row, inverse = np.unique(key, return_index=True, return_inverse=True)
+    total = np.bincount(inverse.ravel(), weights=change, minlength=len(unique_keys)).astype(np.int64)
+    changed = total != 0
+    return low[first_row][changed], high[first_row][changed], total[changed]
+
+
+def apply_flow_delta(g, id1, id2, change):
+    """
+    Adds weight changes to a flow graph in place: existing edges get their weight updated,
+    new pairs become new edges (new zones new vertices) and edges whose weight drops to 0
+    or below are removed.
+
+    Returns:
+    - vertex indices of the zones touched by the change, after the update
+    """
+    id1 = np.asarray(id1, dtype=np.int64)
+    id2 = np.asarray(id2, dtype=np.int64)
+    change = np.asarray(change, dtype=np.int64)
+    names = np.asarray(g.vs['name'], dtype=np.int64)
+    new_zones = np.setdiff1d(np.concatenate([id1, id2]), names)
+    if len(new_zones):
+        g.add_vertices(len(new_zones), attributes={'name': new_zones.tolist()})
+        names = np.concatenate([names, new_zones])
+    pairs = np.column_stack([vertex_indices(names, id1), vertex_indices(names, id2)])
+
+    weight = np.asarray(g.es['weight'] if g.ecount() else [], dtype=np.int64)
+    eids = np.asarray(g.get_eids(pairs=pairs.tolist(), error=False), dtype=np.int64)
+    old = eids >= 0
+    weight[eids[old]] += change[old]
+    g.es['weight'] = weight.tolist()
+    g.es['label'] = weight.tolist()
+
+    added = ~old & (change > 0)
+    if added.any():
+        added_weight = change[added].tolist()
+        g.add_edges(pairs[added].tolist(), attributes={'weight': added_weight, 'label': added_weight})
+    dropped = eids[old][weight[eids[old]] <= 0]
+    if len(dropped):
+        g.delete_edges(dropped.tolist())
+    return np.unique(pairs)
+
+
+def refine_communities(g, prior, n_iterations=1, resolution=1.0):
+    """
+    Leiden (modularity) community detection seeded with a previous partition.
+
+    Parameters:
+    - g: flow graph with 'name' (zone ID) and 'weight' attributes, usually updated with apply_flow_delta
+    - prior: {zone_id: community} (see read_membership) or the name of a membership file;
+      zones that are not in it start in a community of their own
+    - n_iterations: Leiden iterations; when only a small part of the graph changed the seeded
+      partition is nearly stable and one iteration moves only the affected zones
+    - resolution: modularity resolution
+
+    Returns:
+    - igraph.VertexClustering of the refined partition
+    """
+    if isinstance(prior, str):
+        prior = read_membership(prior)
+    fresh = max(prior.values(), default=-1) + 1
+    seed = []
+    for name in g.vs['name']:
+        community = prior.get(name)
+        if community is None:
+            community, fresh = fresh, fresh + 1
+        seed.append(community)
+    seed = np.unique(seed, return_inverse=True)[1].ravel() # consecutive community IDs
+    return g.community_leiden(objective_function='modularity', weights='weight', resolution=resolution,
+                              initial_membership=seed.tolist(), n_iterations=n_iterations)
+
+
+# ----------------------------
+# Community ensembles
+# ----------------------------
+
+_worker = {} # per-process state: the graph every trial permutes
+
+
+def _init_worker(n_vertices, edges, weight, method):
+    # the graph is sent once per worker, not once per trial
+    _worker.update(graph=Graph(n=n_vertices, edges=edges, directed=False), weight=weight, method=method)
+
+
+def _run_trial(seed):
+    # one trial: shuffle the vertex order, detect communities, map the membership back
+    g = _worker['graph']
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(g.vcount())
+    shuffled = g.permute_vertices(perm.tolist()) # vertex perm[i] of g is vertex i of shuffled; edge IDs are kept
+    weight = _worker['weight']
+    if _worker['method'] == 'leiden':
+        clustering = shuffled.community_leiden(objective_function='modularity', weights=weight, n_iterations=-1)
+    else:
+        clustering = shuffled.community_multilevel(weights=weight)
+    return np.asarray(clustering.membership, dtype=np.int64)[np.argsort(perm)]
+
+
+def co_assignment(memberships):
+    """
+    Consensus matrix of a set of partitions.
+
+    Parameters:
+    - memberships: (n_trials, n_vertices) array, one membership per row
+
+    Returns:
+    - (n_vertices, n_vertices) array, entry [i, j] = share of trials that put i and j together
+    """
+    memberships = np.asarray(memberships, dtype=np.int64)
+    n_trials, n_vertices = memberships.shape
+    # one-hot vertex x (trial, community) matrix; M @ M.T counts the trials two vertices share a community
+    labels = np.unique(memberships + np.arange(n_trials)[:, None] * n_vertices, return_inverse=True)[1]
+    rows = np.tile(np.arange(n_vertices), n_trials)
+    one_hot = sparse.csr_matrix((np.ones(len(rows)), (rows, labels.ravel())))
+    return (one_hot @ one_hot.T).toarray() / n_trials
+
+
+def community_ensemble(g, n_trials=100, method='multilevel', n_workers=None, seed=0, threshold=0.5):
+    """
+    Consensus communities of many community detection trials.
+
+    Every trial runs Louvain (community_multilevel) or Leiden on the graph with its vertices in a
+    different random order, so the trials differ the way single runs of the scripts do. Trials run
+    on a process pool. Vertex pairs put together in at least threshold of the trials are linked in
+    a consensus graph (weighted by that share), and Louvain on the consensus graph gives the final
+    partition.
+
+    Parameters:
+    - g: flow graph with a 'weight' edge attribute
+    - n_trials: number of trials
+    - method: 'multilevel' or 'leiden' (modularity)
+    - n_workers: number of processes, defaults to os.cpu_count()
+    - seed: seed of the vertex orders, for repeatable ensembles
+    - threshold: co-assignment share below which a pair is not linked in the consensus graph
+
+    Returns:
+    - membership: (n_vertices,) consensus community of every vertex
+    - stability: (n_vertices,) mean co-assignment of every vertex with the other members of its
+      consensus community (1.0 = always together, 1.0 for single-vertex communities)
+    - consensus: the co-assignment matrix (see co_assignment)
+    """
+    weight = g.es['weight'] if g.ecount() else None
+    initargs = (g.vcount(), g.get_edgelist(), weight, method)
+    seeds = np.random.SeedSequence(seed).spawn(n_trials)
+    n_workers = min(n_workers or os.cpu_count(), n_trials)
+    if n_workers > 1:
+        with Pool(n_workers, initializer=_init_worker, initargs=initargs) as pool:
+            memberships = pool.map(_run_trial, seeds)
+    else:
+        _init_worker(*initargs)
+        memberships = [_run_trial(trial_seed) for trial_seed in seeds]
+    consensus = co_assignment(memberships)
+
+    linked = np.triu(consensus >= threshold, k=1)
+    rows, cols = np.nonzero(linked)
+    consensus_graph = Graph(n=g.vcount(), edges=np.column_stack([rows, cols]).tolist(), directed=False)
+    membership = np.asarray(consensus_graph.community_multilevel(weights=consensus[rows, cols].tolist()).membership)
+
+    same = membership[:, None] == membership[None, :]
+    np.fill_diagonal(same, False)
+    n_same = same.sum(axis=1)
+    stability = np.where(n_same > 0, (consensus * same).sum(axis=1) / np.maximum(n_same, 1), 1.0)
+    return membership, stability, consensus
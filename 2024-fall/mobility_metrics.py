@@ -0,0 +1,299 @@
+"""
+Per-user mobility metrics computed over packed check-in arrays.
+
+The inputs are the (coords, offsets) arrays from trajectory_io: coords is an (n_points, 2)
+array grouped by user and user k owns coords[offsets[k]:offsets[k + 1]]. Every metric is
+computed for all users at once with segmented reductions (np.add.reduceat) instead of a
+Python loop over users.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def _segments(offsets):
+    # start index and number of points of every user; reduceat needs non-empty segments
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    if (lengths == 0).any():
+        raise ValueError("every user needs at least one check-in")
+    return offsets[:-1], lengths
+
+
+def rog_all(coords, offsets):
+    """
+    Radius of gyration of every user in one vectorized sweep.
+
+    ROG = sqrt(sum((lon - mean_lon)^2 + (lat - mean_lat)^2) / n), the same formula as calculate_rog
+    in 7361_HW3_entropy.py. The squared deviations are taken from each user's own mean (two passes),
+    which keeps the result accurate for projected coordinates in the millions.
+
+    Parameters:
+    - coords: (n_points, 2) float array of (lon, lat) grouped by user
+    - offsets: (n_users + 1,) CSR index
+
+    Returns:
+    - (n_users,) float64 array of ROG values, in the order of the offsets index
+    """
+    starts, lengths = _segments(offsets)
+    if len(starts) == 0:
+        return np.empty(0)
+    coords = np.asarray(coords, dtype=np.float64)
+    mean = np.add.reduceat(coords, starts, axis=0) / lengths[:, None] # mean center of each user
+    deviation = coords - np.repeat(mean, lengths, axis=0)
+    squared = np.add.reduceat((deviation ** 2).sum(axis=1), starts)
+    return np.sqrt(squared / lengths)
+
+
+def location_counts(coords, offsets):
+    """
+    Visit counts of every distinct location of every user.
+
+    The check-ins are sorted by (user, lon, lat) and run-length encoded, which is O(n log n)
+    overall no matter how many distinct places a user has.
+
+    Returns:
+    - run_user: (n_runs,) user index of each distinct (user, location)
+    - run_coords: (n_runs, 2) the location
+    - run_counts: (n_runs,) number of check-ins at that location
+    """
+    starts, lengths = _segments(offsets)
+    coords = np.asarray(coords, dtype=np.float64)
+    user = np.repeat(np.arange(len(starts)), lengths)
+    order = np.lexsort((coords[:, 1], coords[:, 0], user))
+    user = user[order]
+    sorted_coords = coords[order]
+
+    new_run = np.ones(len(user), dtype=bool)
+    new_run[1:] = (user[1:] != user[:-1]) | (sorted_coords[1:] != sorted_coords[:-1]).any(axis=1)
+    run_starts = np.flatnonzero(new_run)
+    run_counts = np.diff(np.append(run_starts, len(user)))
+    return user[run_starts], sorted_coords[run_starts], run_counts
+
+
+def entropy_all(coords, offsets):
+    """
+    Location entropy of every user in one batched call.
+
+    entropy = -sum(p * log2(p)) over the distinct (lon, lat) locations of a user, with p the share
+    of the user's check-ins at that location, the same value as calculate_entropy in 7361_HW3_entropy.py.
+
+    Returns:
+    - (n_users,) float64 array of entropy values, in the order of the offsets index
+    """
+    if len(offsets) == 1:
+        return np.empty(0)
+    return _reduce_entropy(coords, offsets, {})['entropy']
+
+
+class EntropyAccumulator:
+    """
+    Incremental location entropy for check-ins that arrive as a stream.
+
+    For every user it keeps the visit count of each location, the total n and S = sum(c * log2(c)),
+    so that entropy = log2(n) - S / n. Adding a check-in updates S in O(1), and the entropy of a
+    user can be read at any moment.
+    """
+
+    def __init__(self):
+        self.counts = {} # user ID -> {(lon, lat): visits}
+        self.totals = {} # user ID -> number of check-ins
+        self.c_log_c = {} # user ID -> sum(c * log2(c)) over the user's locations
+
+    def add(self, user_id, lon, lat):
+        """
+        Adds one check-in of user_id at (lon, lat).
+        """
+        visits = self.counts.setdefault(user_id, {})
+        key = (lon, lat)
+        c = visits.get(key, 0)
+        visits[key] = c + 1
+        self.totals[user_id] = self.totals.get(user_id, 0) + 1
+        gain = (c + 1) * math.log2(c + 1) - (c * math.log2(c) if c else 0.0)
+        self.c_log_c[user_id] = self.c_log_c.get(user_id, 0.0) + gain
+
+    def update(self, user_ids, lons, lats):
+        """
+        Adds a batch of check-ins given as three equal-length sequences.
+        """
+        for user_id, lon, lat in zip(user_ids, lons, lats):
+            self.add(user_id, lon, lat)
+
+    def entropy(self, user_id):
+        """
+        Current location entropy of user_id.
+        """
+        n = self.totals[user_id]
+        return max(math.log2(n) - self.c_log_c[user_id] / n, 0.0) # clamp rounding noise for single-location users
+
+    def entropies(self):
+        """
+        Current entropy of every user seen so far, as a {user_id: entropy} dictionary.
+        """
+        return {user_id: self.entropy(user_id) for user_id in self.totals}
+
+
+# ----------------------------
+# Multi-metric profile
+# ----------------------------
+
+def _location_runs(coords, offsets, cache):
+    # distinct-location counts are shared by the entropy and distinct location reducers
+    if 'runs' not in cache:
+        cache['runs'] = location_counts(coords, offsets)
+    return cache['runs']
+
+
+def _reduce_points(coords, offsets, cache):
+    return {'n_points': np.diff(np.asarray(offsets, dtype=np.int64))}
+
+
+def _reduce_rog(coords, offsets, cache):
+    return {'rog': rog_all(coords, offsets)}
+
+
+def _reduce_entropy(coords, offsets, cache):
+    if len(offsets) == 1: # no users: reduceat needs at least one segment
+        return {'entropy': np.empty(0)}
+    run_user, run_coords, run_counts = _location_runs(coords, offsets, cache)
+    starts, lengths = _segments(offsets)
+    p = run_counts / lengths[run_user]
+    user_first_run = np.flatnonzero(np.r_[True, run_user[1:] != run_user[:-1]])
+    return {'entropy': -np.add.reduceat(p * np.log2(p), user_first_run) + 0.0} # + 0.0 turns -0.0 into 0.0
+
+
+def _reduce_distinct(coords, offsets, cache):
+    run_user, run_coords, run_counts = _location_runs(coords, offsets, cache)
+    return {'n_locations': np.bincount(run_user, minlength=len(offsets) - 1)}
+
+
+def _reduce_extent(coords, offsets, cache):
+    if len(offsets) == 1:
+        empty = np.empty(0)
+        return {'min_lon': empty, 'min_lat': empty, 'max_lon': empty, 'max_lat': empty}
+    starts, lengths = _segments(offsets)
+    low = np.minimum.reduceat(coords, starts, axis=0)
+    high = np.maximum.reduceat(coords, starts, axis=0)
+    return {'min_lon': low[:, 0], 'min_lat': low[:, 1], 'max_lon': high[:, 0], 'max_lat': high[:, 1]}
+
+
+# name -> reducer(coords, offsets, cache) returning {column name: (n_users,) array}
+# add a function here to add a metric to the profile without another pass over the data
+REDUCERS = {
+    'n_points': _reduce_points,
+    'rog': _reduce_rog,
+    'entropy': _reduce_entropy,
+    'n_locations': _reduce_distinct,
+    'extent': _reduce_extent,
+}
+
+
+def profile_users(user_ids, coords, offsets, metrics=None):
+    """
+    Computes several per-user mobility metrics from one loaded copy of the check-ins.
+
+    Parameters:
+    - user_ids, coords, offsets: packed check-ins (see trajectory_io.open_checkins)
+    - metrics: names of the reducers to run (keys of REDUCERS), all of them by default
+
+    Returns:
+    - pandas DataFrame with a UID column and the columns of every requested metric
+    """
+    cache = {}
+    columns = {'UID': np.asarray(user_ids)}
+    for name in metrics or REDUCERS:
+        columns.update(REDUCERS[name](coords, offsets, cache))
+    return pd.DataFrame(columns)
+
+
+def write_profile(profile, out_file):
+    """
+    Writes a profile table as a tab separated file with a header line.
+    """
+    profile.to_csv(out_file, sep='\t', index=False)
+
+
+# ----------------------------
+# Streaming radius of gyration
+# ----------------------------
+
+class RogAccumulator:
+    """
+    Incremental radius of gyration for unsorted, unbounded (uid, lon, lat) streams.
+
+    Each user only keeps a count, a mean center and M2, the running sum of squared distances to
+    that center (Welford), so memory grows with the number of users, not check-ins. Batches are
+    folded in and accumulators from different shards are merged with the parallel update of
+    Chan et al.; ROG = sqrt(M2 / n) can be read at any moment.
+    """
+
+    def __init__(self):
+        self.index = {} # user ID -> row in the arrays below
+        self.user_ids = []
+        self.n = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros((0, 2))
+        self.m2 = np.zeros(0)
+
+    def _rows(self, user_ids):
+        # row of every given user, adding new users (and growing the arrays) as needed
+        rows = np.empty(len(user_ids), dtype=np.int64)
+        for k, user_id in enumerate(user_ids):
+            row = self.index.get(user_id)
+            if row is None:
+                row = self.index[user_id] = len(self.user_ids)
+                self.user_ids.append(user_id)
+            rows[k] = row
+        grow = len(self.user_ids) - len(self.n)
+        if grow > 0:
+            self.n = np.concatenate([self.n, np.zeros(grow, dtype=np.int64)])
+            self.mean = np.concatenate([self.mean, np.zeros((grow, 2))])
+            self.m2 = np.concatenate([self.m2, np.zeros(grow)])
+        return rows
+
+    def _combine(self, rows, n_b, mean_b, m2_b):
+        # Chan et al. merge of per-user (n, mean, M2) partials into the given rows
+        n_a = self.n[rows]
+        n = n_a + n_b
+        delta = mean_b - self.mean[rows]
+        self.mean[rows] += delta * (n_b / n)[:, None]
+        self.m2[rows] += m2_b + (delta ** 2).sum(axis=1) * n_a * n_b / n
+        self.n[rows] = n
+
+    def add(self, user_id, lon, lat):
+        """
+        Adds one check-in.
+        """
+        self.update([user_id], [lon], [lat])
+
+    def update(self, user_ids, lons, lats):
+        """
+        Adds a batch of check-ins in any order; the batch is reduced per user with NumPy first.
+        """
+        unique_ids, inverse = np.unique(np.asarray(user_ids), return_inverse=True)
+        points = np.column_stack([np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64)])
+        n_b = np.bincount(inverse, minlength=len(unique_ids))
+        mean_b = np.column_stack([np.bincount(inverse, points[:, d], len(unique_ids)) for d in range(2)]) / n_b[:, None]
+        m2_b = np.bincount(inverse, ((points - mean_b[inverse]) ** 2).sum(axis=1), len(unique_ids))
+        self._combine(self._rows(unique_ids.tolist()), n_b, mean_b, m2_b)
+
+    def merge(self, other):
+        """
+        Folds the partial accumulator of another shard into this one.
+        """
+        if other.user_ids:
+            self._combine(self._rows(other.user_ids), other.n, other.mean, other.m2)
+        return self
+
+    def rog(self, user_id):
+        """
+        Current ROG of user_id.
+        """
+        row = self.index[user_id]
+        return float(np.sqrt(self.m2[row] / self.n[row]))
+
+    def rogs(self):
+        """
+        Current ROG of every user seen so far, as a {user_id: rog} dictionary.
+        """
+        return dict(zip(self.user_ids, np.sqrt(self.m2 / self.n).tolist()))
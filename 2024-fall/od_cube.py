@@ -0,0 +1,188 @@
+"""
+Origin x destination x time OD cubes for taxi and MetroBike trips.
+
+Trips are binned in one pass by (origin, destination, hour) and stored as a sparse 3-D array
+in coordinate form: one row per non-empty cell with the origin, the destination, the hour
+(hours since 1970-01-01) and the number of trips. The hour of day, weekday and date of a
+cell all follow from its hour, so any slice (weekday, weekend, AM peak, one date, directed
+or symmetrized flows) is derived from the cube without reading the raw trips again.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+WEEKDAYS = (0, 1, 2, 3, 4) # Monday..Friday, as in pandas dt.weekday
+WEEKEND = (5, 6)
+AM_PEAK = (7, 8, 9) # hours of day
+PM_PEAK = (16, 17, 18)
+CHUNK_ROWS = 1_000_000
+
+
+def _reduce(origin, dest, hour, count):
+    # sum the counts of identical (origin, dest, hour) cells
+    if len(origin) == 0:
+        return origin, dest, hour, count
+    order = np.lexsort((hour, dest, origin))
+    origin, dest, hour, count = origin[order], dest[order], hour[order], count[order]
+    new_cell = np.ones(len(origin), dtype=bool)
+    new_cell[1:] = (origin[1:] != origin[:-1]) | (dest[1:] != dest[:-1]) | (hour[1:] != hour[:-1])
+    starts = np.flatnonzero(new_cell)
+    return origin[starts], dest[starts], hour[starts], np.add.reduceat(count, starts)
+
+
+def _trip_hours(frame, time_cols, time_format):
+    # hours since 1970-01-01 of every trip and a mask of the trips whose time could be parsed
+    # (NaT has no hour); two columns (date, time) are joined first
+    if isinstance(time_cols, str):
+        text = frame[time_cols]
+    else:
+        text = frame[time_cols[0]].astype(str)
+        for col in time_cols[1:]:
+            text = text + ' ' + frame[col].astype(str)
+    times = pd.to_datetime(text, format=time_format, errors='coerce')
+    return times.to_numpy().astype('datetime64[h]').astype(np.int64), times.notna().to_numpy()
+
+
+class ODCube:
+    """
+    Sparse (origin, destination, hour) trip counts.
+
+    Attributes:
+    - origin, dest: zone / kiosk ID of every non-empty cell
+    - hour: hours since 1970-01-01 of every cell
+    - count: number of trips in every cell
+    """
+
+    def __init__(self, origin, dest, hour, count):
+        self.origin, self.dest, self.hour, self.count = _reduce(
+            np.asarray(origin, dtype=np.int64), np.asarray(dest, dtype=np.int64),
+            np.asarray(hour, dtype=np.int64), np.asarray(count, dtype=np.int64))
+
+    @classmethod
+    def from_frame(cls, frame, origin_col, dest_col, time_cols, time_format=None, stats=None):
+        """
+        Builds a cube from a DataFrame of trips. Rows with a missing origin, destination or time, or
+        a time that cannot be parsed, are dropped.
+
+        Parameters:
+        - origin_col, dest_col: column names of the origin and destination IDs
+        - time_cols: name of the trip start time column, or a list such as ['Checkout Date', 'Checkout Time']
+        - time_format: optional strftime format of the (joined) time text
+        - stats: optional extract_flows.FlowStats; the rows are counted like in count_flow: blank
+          (missing origin, destination or time), malformed (unparseable time), self-loops and pairs
+          (the other trips, all of which are kept in the cube)
+        """
+        time_list = [time_cols] if isinstance(time_cols, str) else list(time_cols)
+        blank = frame[[origin_col, dest_col] + time_list].isna().any(axis=1).to_numpy()
+        kept = frame[~blank]
+        hour, parsed = _trip_hours(kept, time_cols, time_format)
+        kept = kept[parsed]
+        hour = hour[parsed]
+        origin = kept[origin_col].to_numpy(np.float64).astype(np.int64)
+        dest = kept[dest_col].to_numpy(np.float64).astype(np.int64)
+        if stats is not None:
+            stats.rows += len(frame)
+            stats.blank += int(blank.sum())
+            stats.malformed += int((~parsed).sum())
+            stats.self_loops += int((origin == dest).sum())
+            stats.pairs += int((origin != dest).sum())
+        return cls(origin, dest, hour, np.ones(len(kept), dtype=np.int64))
+
+    @classmethod
+    def from_csv(cls, infile, origin_col, dest_col, time_cols, time_format=None, chunk_rows=CHUNK_ROWS, stats=None):
+        """
+        Builds a cube from a trip CSV in one chunked pass, e.g.
+        ODCube.from_csv("yellow_tripdata_2020-05.csv", 'PULocationID', 'DOLocationID', 'tpep_pickup_datetime').
+        Only the needed columns are read, and every chunk is reduced to its non-empty cells right away.
+        """
+        time_list = [time_cols] if isinstance(time_cols, str) else list(time_cols)
+        cells = []
+        for chunk in pd.read_csv(infile, usecols=[origin_col, dest_col] + time_list, chunksize=chunk_rows):
+            part = cls.from_frame(chunk, origin_col, dest_col, time_cols, time_format, stats)
+            cells.append((part.origin, part.dest, part.hour, part.count))
+        if not cells:
+            return cls([], [], [], [])
+        return cls(*(np.concatenate(column) for column in zip(*cells)))
+
+    # ----- time of each cell -----
+
+    def hour_of_day(self):
+        return self.hour % 24
+
+    def weekday(self):
+        return (self.hour // 24 + 3) % 7 # 1970-01-01 was a Thursday; Monday = 0
+
+    def date(self):
+        return (self.hour // 24).astype('datetime64[D]')
+
+    # ----- slices -----
+
+    def select(self, hours=None, weekdays=None, start=None, end=None):
+        """
+        Sub-cube of the cells in the given hours of day, weekdays and date range.
+
+        Parameters:
+        - hours: iterable of hours of day (0-23), e.g. AM_PEAK
+        - weekdays: iterable of weekdays (Monday = 0), e.g. WEEKDAYS or WEEKEND
+        - start, end: first and last date to keep, as 'YYYY-MM-DD' strings or datetime64 values
+        """
+        keep = np.ones(len(self.count), dtype=bool)
+        if hours is not None:
+            keep &= np.isin(self.hour_of_day(), list(hours))
+        if weekdays is not None:
+            keep &= np.isin(self.weekday(), list(weekdays))
+        if start is not None:
+            keep &= self.date() >= np.datetime64(start, 'D')
+        if end is not None:
+            keep &= self.date() <= np.datetime64(end, 'D')
+        return ODCube(self.origin[keep], self.dest[keep], self.hour[keep], self.count[keep])
+
+    def flows(self, directed=True, self_loops=False):
+        """
+        Trip counts per zone pair, summed over time.
+
+        Parameters:
+        - directed: False folds (b, a) into (min, max); count_flow instead keeps the orientation
+          in which a pair first appears, so its keys may be (max, min)
+        - self_loops: keep trips that start and end in the same zone
+
+        Returns:
+        - id1, id2, weight arrays, sorted by (id1, id2)
+        """
+        origin, dest = self.origin, self.dest
+        if not directed:
+            origin, dest = np.minimum(origin, dest), np.maximum(origin, dest)
+        keep = np.ones(len(origin), dtype=bool) if self_loops else origin != dest
+        zero_hour = np.zeros(int(keep.sum()), dtype=np.int64)
+        id1, id2, hour, weight = _reduce(origin[keep], dest[keep], zero_hour, self.count[keep])
+        return id1, id2, weight
+
+    def matrix(self, directed=True, size=None):
+        """
+        Sparse CSR origin x destination matrix indexed by zone ID (one triangle when directed=False).
+        """
+        id1, id2, weight = self.flows(directed)
+        size = size if size is not None else int(max(id1.max(initial=-1), id2.max(initial=-1))) + 1
+        return sparse.coo_matrix((weight, (id1, id2)), shape=(size, size)).tocsr()
+
+    def flow_arrays(self, directed=False):
+        """
+        ids, id1, id2, weight arrays of this slice (see flows), the input of flow_graph.build_flow_graph;
+        ids is sorted by zone ID.
+        """
+        id1, id2, weight = self.flows(directed)
+        return np.unique(np.concatenate([id1, id2])), id1, id2, weight
+
+    def flow_count(self, directed=False):
+        """
+        The (id_list, flow_count_dict) shape of count_flow for this slice. id_list is sorted by zone ID
+        and undirected pairs are keyed (min, max), not in count_flow's first-appearance order and orientation.
+        """
+        ids, id1, id2, weight = self.flow_arrays(directed)
+        return ids.tolist(), dict(zip(zip(id1.tolist(), id2.tolist()), weight.tolist()))
+
+    def hourly_totals(self):
+        """
+        Number of trips per hour of day (24 values), e.g. to pick peak hours.
+        """
+        return np.bincount(self.hour_of_day(), weights=self.count, minlength=24).astype(np.int64)
@@ -0,0 +1,194 @@
+"""
+Benchmark harness for external_sort.
+
+Every configuration runs in a new interpreter process with its own output file and temporary
+folder, so no state (open files, run lists, imported modules, peak memory) carries over from one
+run to the next. A run records the time of the split, sort and merge phases, the
+peak resident memory of the sort and of its sort workers, and the bytes read and written.
+The results are written as JSON, so runs on different machines or commits can be compared.
+
+auto_config picks the memory budget and merge fan-in from the memory available on the machine
+and the size of the input file.
+"""
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+import traceback
+
+from external_sort import external_sort, MIN_BLOCK_BYTES
+
+MEMORY_FRACTION = 0.5 # share of the available memory a sort may use
+MERGE_BLOCK_BYTES = 1024 * 1024 # smallest merge read per run auto_config aims for
+
+
+def available_memory():
+    """
+    Bytes of memory available for new work (MemAvailable on Linux, available physical memory on
+    Windows, free physical pages elsewhere).
+    """
+    if os.name == 'nt': # no /proc or sysconf on Windows
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            raise ctypes.WinError()
+        return status.ullAvailPhys
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def auto_config(infile, n_workers=None, memory_budget=None, memory_fraction=MEMORY_FRACTION, memory=None):
+    """
+    external_sort settings for a file on this machine.
+
+    The memory budget is memory_fraction of the available memory, but no more than the file
+    needs to be sorted in one run per worker. The fan-in is the number of runs that budget gives,
+    capped so every run still gets merge reads of at least MERGE_BLOCK_BYTES; more runs than
+    that are merged in several passes.
+
+    Parameters:
+    - infile: file to sort
+    - n_workers: sort workers, defaults to os.cpu_count()
+    - memory_budget: fixed budget to pick the fan-in for, instead of one derived from the memory
+    - memory_fraction: share of the available memory to use
+    - memory: bytes available, by default available_memory()
+
+    Returns:
+    - {'memory_budget': bytes, 'fan_in': runs merged at once, 'n_workers': sort workers}
+    """
+    n_workers = n_workers or os.cpu_count()
+    chunks_alive = 1 if n_workers == 1 else 2 * n_workers # as in external_sort
+    file_size = os.path.getsize(infile)
+    if memory_budget is None:
+        memory = available_memory() if memory is None else memory
+        memory_budget = int(min(memory * memory_fraction, 4 * chunks_alive * max(file_size, MIN_BLOCK_BYTES)))
+    run_bytes = max(memory_budget // (4 * chunks_alive), MIN_BLOCK_BYTES)
+    n_runs = max(1, math.ceil(file_size / run_bytes))
+    fan_in = max(2, min(n_runs, memory_budget // (4 * MERGE_BLOCK_BYTES)))
+    return {'memory_budget': memory_budget, 'fan_in': fan_in, 'n_workers': n_workers}
+
+
+def _peak_rss():
+    # peak resident memory of this process and of its finished children, in bytes; (None, None) on
+    # Windows, which has no resource module
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1 if platform.system() == 'Darwin' else 1024 # ru_maxrss is in bytes on macOS, KiB elsewhere
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children
+
+
+def _run_once(infile, column, config, tmp_dir):
+    # one benchmark run: sort into a folder of its own and remove it afterwards
+    run_dir = tempfile.mkdtemp(prefix='sort_bench_', dir=tmp_dir)
+    try:
+        start = time.perf_counter()
+        info = external_sort(infile, os.path.join(run_dir, 'sorted.csv'), column, tmp_dir=run_dir, **config)
+        info['wall'] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    info['peak_rss'], info['peak_rss_workers'] = _peak_rss()
+    return info
+
+
+def _child(connection, *args):
+    # entry point of the fresh process; the sort may start its own worker pool, so this is a plain
+    # (non-daemon) process rather than a pool worker
+    try:
+        connection.send(('ok', _run_once(*args)))
+    except BaseException:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_isolated(infile, column, config, tmp_dir=None):
+    """
+    One external_sort run in a new interpreter (spawn), so nothing is inherited from earlier runs.
+
+    Returns:
+    - the external_sort result with 'wall', 'peak_rss' and 'peak_rss_workers' (bytes, None on Windows) added
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(sender, infile, column, config, tmp_dir))
+    process.start()
+    sender.close()
+    try:
+        status, payload = receiver.recv()
+    except EOFError:
+        status, payload = 'error', f"benchmark process exited with code {process.exitcode}"
+    process.join()
+    if status == 'error':
+        raise RuntimeError(f"sort run {config} failed:\n{payload}")
+    return payload
+
+
+def default_configs(infile, n_workers=None):
+    """
+    auto_config, and budgets of a quarter, half and twice its size (each with its own fan-in),
+    for a sweep around the automatic pick.
+    """
+    auto = auto_config(infile, n_workers)
+    budgets = [max(auto['memory_budget'] // 4, 4 * MIN_BLOCK_BYTES), max(auto['memory_budget'] // 2, 4 * MIN_BLOCK_BYTES),
+               auto['memory_budget'], 2 * auto['memory_budget']]
+    return [auto_config(infile, n_workers, memory_budget=budget) for budget in budgets]
+
+
+def benchmark_sort(infile, column, configs=None, repeats=1, out_json='sort_benchmark.json', tmp_dir=None):
+    """
+    Times external_sort on one file for several configurations.
+
+    Parameters:
+    - infile, column: file and sort column, as for external_sort
+    - configs: list of external_sort keyword dictionaries (memory_budget, fan_in, n_workers, ...),
+      by default default_configs(infile)
+    - repeats: runs per configuration
+    - out_json: file the results are written to (None to skip)
+    - tmp_dir: folder for the outputs and temporary runs, by default next to infile
+
+    Returns:
+    - {'machine': ..., 'input': ..., 'runs': [one record per run: the configuration, the repeat,
+      and the external_sort result with 'wall', 'peak_rss' and 'peak_rss_workers' added]}
+    """
+    configs = default_configs(infile) if configs is None else configs
+    tmp_dir = tmp_dir or os.path.dirname(os.path.abspath(infile))
+    records = []
+    for config in configs:
+        for repeat in range(repeats):
+            info = run_isolated(infile, column, config, tmp_dir)
+            records.append({'config': config, 'repeat': repeat, **info})
+
+    results = {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpu_count': os.cpu_count(), 'available_memory': available_memory()},
+        'input': {'file': os.path.abspath(infile), 'bytes': os.path.getsize(infile), 'column': column},
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': records,
+    }
+    if out_json:
+        with open(out_json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
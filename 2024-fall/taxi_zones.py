@@ -0,0 +1,233 @@
+"""
+Vectorized taxi zone statistics for the NYC yellow cab trip files.
+
+Zone IDs are small integers (1..265 for the NYC taxi zones, 264/265 are "unknown"), so a
+histogram is a dense array indexed by zone ID built with np.bincount instead of a Counter
+over a Python list. Index 0 is unused.
+
+Trip files are read column-projected (only the zone columns, as compact integers) and in
+chunks, so a month or a whole year of trips is counted in bounded memory.
+"""
+import os
+import re
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cache import AggregateCache
+
+N_ZONES = 265 # highest NYC taxi zone ID
+ZONE_DTYPE = 'UInt16' # zone IDs fit in 16 bits; the nullable type keeps blank cells as <NA>
+CHUNK_ROWS = 1_000_000
+
+
+def zone_counts(zone_ids, n_zones=N_ZONES):
+    """
+    Number of trips per zone.
+
+    Parameters:
+    - zone_ids: integer array (or pandas column) of zone IDs; missing values are ignored
+    - n_zones: highest expected zone ID; the result grows if a larger ID shows up
+
+    Returns:
+    - int64 array of length >= n_zones + 1, counts[z] = number of trips in zone z
+    """
+    zone_ids = np.asarray(zone_ids)
+    if zone_ids.dtype.kind == 'f': # a column with missing values is read as float
+        zone_ids = zone_ids[~np.isnan(zone_ids)]
+    return np.bincount(zone_ids.astype(np.int64, copy=False), minlength=n_zones + 1)
+
+
+def counts_to_shares(counts):
+    """
+    Turns per-zone counts into per-zone shares (the counts divided by their total).
+    """
+    total = counts.sum()
+    return counts / total if total else np.zeros(len(counts))
+
+
+def zone_shares(zone_ids, n_zones=N_ZONES):
+    """
+    Share of trips per zone as a dense array, the array form of percent_by_count in 7361_HW5_taxi.py.
+    """
+    return counts_to_shares(zone_counts(zone_ids, n_zones))
+
+
+def share_diff(shares1, shares2):
+    """
+    Difference of two dense share arrays (shares1 - shares2), the array form of cmp_dict.
+    The shorter array is padded with zeros, so zones missing from one month count as 0.
+
+    Returns:
+    - diff: shares1 - shares2
+    - zones: zone IDs present in at least one of the two inputs (the keys cmp_dict would return)
+    """
+    size = max(len(shares1), len(shares2))
+    a = np.zeros(size)
+    b = np.zeros(size)
+    a[:len(shares1)] = shares1
+    b[:len(shares2)] = shares2
+    return a - b, np.flatnonzero((a > 0) | (b > 0))
+
+
+def write_zone_values(out_file, zones, values, header="zone_id\tpercent_diff\n"):
+    """
+    Writes "zone_id\\tvalue" lines for the given zones.
+    """
+    with open(out_file, "w") as file:
+        file.write(header)
+        file.writelines(f"{zone_id}\t{value}\n" for zone_id, value in zip(zones.tolist(), values[zones].tolist()))
+
+
+def iter_trip_chunks(file_name, columns=('PULocationID',), chunk_rows=CHUNK_ROWS):
+    """
+    Reads only the given zone columns of a yellow_tripdata CSV, chunk by chunk, as uint16 arrays.
+
+    Blank values are dropped per column, so a blank drop-off zone does not hide the pickup zone of
+    the same row; the arrays of one chunk can therefore differ in length.
+
+    Yields:
+    - {column name: uint16 array} for every chunk of chunk_rows rows
+    """
+    columns = list(columns)
+    reader = pd.read_csv(file_name, usecols=columns, dtype={column: ZONE_DTYPE for column in columns},
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        yield {column: chunk[column].dropna().to_numpy(dtype=np.uint16) for column in columns}
+
+
+def read_zone_counts(file_names, columns=('PULocationID',), n_zones=N_ZONES, chunk_rows=CHUNK_ROWS, cache=None):
+    """
+    Streams one or more trip files into running per-zone counters.
+
+    Parameters:
+    - file_names: a file name or a list of file names (e.g. all monthly files of a year)
+    - columns: zone columns to count, e.g. ('PULocationID', 'DOLocationID')
+    - n_zones: highest expected zone ID
+    - chunk_rows: rows parsed per chunk; peak memory depends on chunk_rows, not on the file size
+    - cache: optional aggregate_cache.AggregateCache; the counts of every file are then kept on disk
+      and an unchanged file is not read again
+
+    Returns:
+    - {column name: per-zone count array (see zone_counts)}
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    counts = {column: np.zeros(n_zones + 1, dtype=np.int64) for column in columns}
+    for file_name in file_names:
+        if cache is None:
+            file_counts = _scan_zone_counts(file_name, columns, n_zones, chunk_rows)
+        else:
+            params = {'kind': 'zone_counts', 'columns': list(columns), 'n_zones': n_zones, 'dropna': 'per_column'}
+            file_counts = cache.cached(file_name, params,
+                                       lambda: _scan_zone_counts(file_name, columns, n_zones, chunk_rows))
+        for column in columns:
+            counts[column] = _add_counts(counts[column], file_counts[column])
+    return counts
+
+
+def _add_counts(total, counts):
+    # total + counts for count arrays of possibly different lengths (an unexpected zone ID above n_zones)
+    if len(counts) > len(total):
+        total, counts = counts.copy(), total
+    total[:len(counts)] += counts
+    return total
+
+
+def _scan_zone_counts(file_name, columns, n_zones, chunk_rows):
+    # one pass over one trip file
+    counts = {column: np.zeros(n_zones + 1, dtype=np.int64) for column in columns}
+    for chunk in iter_trip_chunks(file_name, columns, chunk_rows):
+        for column, zone_ids in chunk.items():
+            counts[column] = _add_counts(counts[column], zone_counts(zone_ids, n_zones))
+    return counts
+
+
+# ----------------------------
+# Multi-month comparison
+# ----------------------------
+
+def month_label(file_name):
+    """
+    Month of a trip file name, e.g. yellow_tripdata_2020-05.csv -> '2020-05' (the base name if there is none).
+    """
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    match = re.search(r'\d{4}-\d{2}', base)
+    return match.group(0) if match else base
+
+
+def _file_counts(file_name, column, n_zones, chunk_rows, cache_dir):
+    # one worker task: the per-zone counts of one file
+    cache = AggregateCache(cache_dir) if cache_dir else None
+    return read_zone_counts(file_name, (column,), n_zones, chunk_rows, cache)[column]
+
+
+def zone_share_matrix(file_names, column='PULocationID', n_workers=None, n_zones=N_ZONES, chunk_rows=CHUNK_ROWS,
+                      cache_dir=None):
+    """
+    Per-zone trip shares of many trip files, aggregated in parallel (one file per worker task).
+
+    Parameters:
+    - file_names: list of trip files, e.g. 12-24 monthly yellow_tripdata_*.csv files
+    - column: zone column to count
+    - n_workers: number of processes, defaults to min(len(file_names), os.cpu_count())
+    - cache_dir: folder of an AggregateCache; files already counted with the same column are not read again
+
+    Returns:
+    - shares: (n_zone_ids, n_files) array, shares[z, m] = share of trips of file m in zone z
+    - counts: the matching per-zone trip counts
+    - labels: month label of every file (see month_label)
+    """
+    file_names = list(file_names)
+    task = partial(_file_counts, column=column, n_zones=n_zones, chunk_rows=chunk_rows, cache_dir=cache_dir)
+    n_workers = n_workers or min(len(file_names), os.cpu_count())
+    if n_workers > 1:
+        with Pool(n_workers) as pool:
+            per_file = pool.map(task, file_names) # results keep the order of file_names
+    else:
+        per_file = [task(file_name) for file_name in file_names]
+
+    size = max(len(c) for c in per_file)
+    counts = np.zeros((size, len(file_names)), dtype=np.int64)
+    for m, c in enumerate(per_file):
+        counts[:len(c), m] = c
+    totals = counts.sum(axis=0)
+    shares = counts / np.where(totals > 0, totals, 1)
+    return shares, counts, [month_label(file_name) for file_name in file_names]
+
+
+def pairwise_share_diffs(shares):
+    """
+    All pairwise differences of a zone x month share matrix in one broadcast.
+
+    Returns:
+    - (n_zone_ids, n_months, n_months) array, diffs[z, i, j] = shares[z, i] - shares[z, j]
+    """
+    return shares[:, :, None] - shares[:, None, :]
+
+
+def write_share_diffs(shares, labels, pairs, out_pattern="diff_{1}_{0}_pu.txt"):
+    """
+    Writes one diff_jan_may_pu.txt-style file per (i, j) month pair, with shares[:, i] - shares[:, j]
+    for every zone that has trips in either month.
+
+    Parameters:
+    - shares, labels: output of zone_share_matrix
+    - pairs: list of (i, j) month indices, e.g. [(1, 0)] for May minus January
+    - out_pattern: file name pattern, formatted with the labels of month i and month j
+
+    Returns:
+    - list of the written file names
+    """
+    rows, cols = np.asarray(pairs, dtype=np.int64).reshape(-1, 2).T
+    diffs = shares[:, rows] - shares[:, cols] # (n_zone_ids, n_pairs) in one step
+    present = (shares[:, rows] > 0) | (shares[:, cols] > 0)
+    out_files = []
+    for k, (i, j) in enumerate(zip(rows, cols)):
+        zones = np.flatnonzero(present[:, k])
+        out_file = out_pattern.format(labels[i], labels[j])
+        pd.DataFrame({'zone_id': zones, 'percent_diff': diffs[zones, k]}).to_csv(out_file, sep='\t', index=False)
+        out_files.append(out_file)
+    return out_files
@@ -0,0 +1,336 @@
+"""
+Batched dynamic time warping (DTW) for check-in trajectories.
+
+Trajectories are packed into one contiguous (n_points, 2) float64 array plus an
+offsets array (user k owns coords[offsets[k]:offsets[k + 1]]), so the distance
+kernel can work on many user pairs at once instead of calling fastdtw pair by pair.
+"""
+import os
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+
+def pack_trajectories(user_coor_dict):
+    """
+    Packs a {user_id: [(lon, lat), ...]} dictionary into contiguous arrays.
+
+    Parameters:
+    - user_coor_dict: dictionary of coordinate lists keyed by user ID
+
+    Returns:
+    - user_ids: list of user IDs in dictionary order
+    - coords: (n_points, 2) float64 array with the coordinates of all users
+    - offsets: (n_users + 1,) int64 array, user k owns coords[offsets[k]:offsets[k + 1]]
+    """
+    user_ids = list(user_coor_dict)
+    lengths = [len(user_coor_dict[uid]) for uid in user_ids]
+    offsets = np.zeros(len(user_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    coords = np.empty((offsets[-1], 2), dtype=np.float64)
+    for k, uid in enumerate(user_ids):
+        coords[offsets[k]:offsets[k + 1]] = user_coor_dict[uid]
+    return user_ids, coords, offsets
+
+
+def condensed_pairs(n_users):
+    """
+    Returns the (row, col) user indices of every pair in condensed order, i.e. the
+    same order as itertools.combinations(range(n_users), 2) and scipy's pdist.
+    """
+    rows, cols = np.triu_indices(n_users, k=1)
+    return rows.astype(np.int64), cols.astype(np.int64)
+
+
+def _padded(coords, offsets, users):
+    # copy the trajectories of the given users into a (len(users), max_len, 2) block
+    lengths = offsets[users + 1] - offsets[users]
+    max_len = int(lengths.max())
+    block = np.zeros((len(users), max_len, 2), dtype=np.float64)
+    for k, (start, length) in enumerate(zip(offsets[users], lengths)):
+        block[k, :length] = coords[start:start + length]
+    return block, lengths
+
+
+def length_buckets(*lengths):
+    """
+    Splits items (trajectories, or pairs of them) into groups of similar length, so a kernel that
+    pads every trajectory of a group to the longest one does less than twice the real work: all
+    lengths of a group lie in the same power-of-two range (one range per given length array).
+
+    Parameters:
+    - lengths: one or more (n,) arrays of trajectory lengths, e.g. the x and y lengths of each pair
+
+    Returns:
+    - list of index arrays into the n items
+    """
+    key = np.zeros(len(lengths[0]), dtype=np.int64)
+    if len(key) == 0:
+        return []
+    for length in lengths:
+        key = key * 64 + np.ceil(np.log2(np.maximum(length, 1))).astype(np.int64)
+    order = np.argsort(key, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(key[order])) + 1)
+
+
+def dtw_block(coords, offsets, rows, cols, window=None, max_dist=None):
+    """
+    Computes the exact DTW distance of many trajectory pairs at once.
+
+    The dynamic programming table is filled one row at a time for every pair in the
+    block. Inside a row the recursion D[i, j] = c[i, j] + min(D[i-1, j-1], D[i-1, j], D[i, j-1])
+    is a running minimum over a prefix sum, so each row is a handful of NumPy calls.
+
+    Pairs are oriented so the shorter trajectory gives the rows (DTW is symmetric) and grouped
+    with length_buckets, so one long trajectory does not pad every other pair of the block to its
+    length; the results come back in the order of rows/cols.
+
+    Parameters:
+    - coords, offsets: packed trajectories (see pack_trajectories)
+    - rows, cols: int arrays with the user indices of each pair
+    - window: Sakoe-Chiba band half-width in points, None for exact (unconstrained) DTW.
+      The band is widened to the length difference of the pair so the end cell is always reachable.
+    - max_dist: early abandoning threshold (scalar or one per pair). Every warping path crosses every
+      row, so once a whole row is above the threshold the pair is dropped and reported as inf.
+
+    Returns:
+    - (n_pairs,) float64 array of DTW distances (Euclidean point cost, same as fastdtw(x, y, dist=euclidean))
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    result = np.empty(len(rows), dtype=np.float64)
+    if len(rows) == 0:
+        return result
+    if max_dist is not None:
+        max_dist = np.broadcast_to(np.asarray(max_dist, dtype=np.float64), (len(rows),))
+
+    lengths = offsets[1:] - offsets[:-1]
+    swap = lengths[rows] > lengths[cols]
+    rows, cols = np.where(swap, cols, rows), np.where(swap, rows, cols)
+    for idx in length_buckets(lengths[rows], lengths[cols]):
+        result[idx] = _dtw_padded(coords, offsets, rows[idx], cols[idx], window,
+                                  None if max_dist is None else max_dist[idx])
+    return result
+
+
+def _dtw_padded(coords, offsets, rows, cols, window, max_dist):
+    # the dtw_block kernel for pairs of similar lengths, padded to the longest trajectory on each side
+    n_pairs = len(rows)
+    result = np.empty(n_pairs, dtype=np.float64)
+    x, x_len = _padded(coords, offsets, rows)
+    y, y_len = _padded(coords, offsets, cols)
+    n_max = x.shape[1]
+    m_max = y.shape[1]
+    j_idx = np.arange(m_max)
+    pair_idx = np.arange(n_pairs)
+
+    if window is not None:
+        band = np.maximum(int(window), np.abs(x_len - y_len))[:, None] # per pair band half-width
+
+    active = np.ones(n_pairs, dtype=bool) # pairs that are neither finished nor abandoned
+
+    prev = np.full((n_pairs, m_max), np.inf)
+    for i in range(n_max):
+        cost = np.sqrt(((x[:, i, None, :] - y) ** 2).sum(axis=2)) # (n_pairs, m_max) point distances for row i
+
+        # best predecessor from the row above: min(D[i-1, j-1], D[i-1, j]); D[-1, -1] is the 0 start cell
+        above = prev.copy()
+        above[:, 1:] = np.minimum(prev[:, 1:], prev[:, :-1])
+        if i == 0:
+            above[:, 0] = 0.0
+
+        # D[i, j] = S[j] + min_{k <= j}(above[k] + cost[k] - S[k]) with S the running sum of the row costs
+        if window is not None:
+            outside = np.abs(j_idx - i) > band
+            above[outside] = np.inf
+        prefix = np.cumsum(cost, axis=1)
+        row = prefix + np.minimum.accumulate(above + cost - prefix, axis=1)
+        if window is not None:
+            row[outside] = np.inf
+
+        # pairs whose first trajectory ends on this row are finished
+        done = x_len == i + 1
+        if done.any():
+            result[done] = row[pair_idx[done], y_len[done] - 1]
+        active &= ~done
+
+        if max_dist is not None:
+            row_min = np.where(j_idx < y_len[:, None], row, np.inf).min(axis=1) # ignore the padding columns
+            abandon = active & (row_min > max_dist)
+            result[abandon] = np.inf
+            active &= ~abandon
+        if not active.any():
+            break
+        prev = row
+    return result
+
+
+def pairwise_dtw(coords, offsets, window=None, block_size=2048):
+    """
+    Computes the DTW distance of every user pair as a condensed distance vector.
+
+    Parameters:
+    - coords, offsets: packed trajectories (see pack_trajectories)
+    - window: Sakoe-Chiba band half-width, None for exact DTW
+    - block_size: number of pairs handed to dtw_block at once (bounds memory use)
+
+    Returns:
+    - (n_users * (n_users - 1) / 2,) float64 array in itertools.combinations order
+    """
+    rows, cols = condensed_pairs(len(offsets) - 1)
+    dist = np.empty(len(rows), dtype=np.float64)
+    for start in range(0, len(rows), block_size):
+        stop = start + block_size
+        dist[start:stop] = dtw_block(coords, offsets, rows[start:stop], cols[start:stop], window)
+    return dist
+
+
+def dtw_distance(x, y, window=None):
+    """
+    DTW distance between two trajectories given as lists or arrays of (lon, lat) points.
+    """
+    user_ids, coords, offsets = pack_trajectories({0: x, 1: y})
+    return dtw_block(coords, offsets, [0], [1], window)[0]
+
+
+def euclidean_block(coords, offsets, rows, cols):
+    """
+    Mean point-to-point Euclidean distance of many trajectory pairs at once (HW4 Task 2).
+    Pairs whose trajectories have a different number of points get -1, like euclidean_dist.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    result = np.full(len(rows), -1.0)
+    if len(rows) == 0:
+        return result
+
+    lengths = offsets[1:] - offsets[:-1]
+    same = np.flatnonzero(lengths[rows] == lengths[cols])
+    for idx in length_buckets(lengths[rows[same]]): # pad each group only to its own longest trajectory
+        pairs = same[idx]
+        x, x_len = _padded(coords, offsets, rows[pairs])
+        y, y_len = _padded(coords, offsets, cols[pairs])
+        point_dist = np.sqrt(((x - y) ** 2).sum(axis=2))
+        valid = np.arange(x.shape[1]) < x_len[:, None] # ignore the zero padding after each trajectory
+        result[pairs] = (point_dist * valid).sum(axis=1) / x_len
+    return result
+
+
+# ----------------------------
+# Process pool execution
+# ----------------------------
+
+_KERNELS = {
+    'dtw': lambda coords, offsets, rows, cols, window: dtw_block(coords, offsets, rows, cols, window),
+    'euclidean': lambda coords, offsets, rows, cols, window: euclidean_block(coords, offsets, rows, cols),
+}
+_worker = {} # per-process state: shared memory handles and the array views on them
+
+
+def _share(array):
+    # make an array reachable from the workers; returns (segment or None, spec for _attach)
+    # memory-mapped .npy files (see trajectory_io.open_store) are simply re-opened by path
+    if isinstance(array, np.memmap) and array.filename and array.filename.endswith('.npy'):
+        return None, ('npy', array.filename)
+    # anything else is copied once into a new shared memory segment
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment, ('shm', segment.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    if spec[0] == 'npy':
+        return None, np.load(spec[1], mmap_mode='r')
+    kind, name, shape, dtype = spec
+    segment = shared_memory.SharedMemory(name=name)
+    return segment, np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _init_worker(coords_spec, offsets_spec, metric, window):
+    # attach once per worker; the trajectories are never pickled per task
+    coords_shm, coords = _attach(coords_spec)
+    offsets_shm, offsets = _attach(offsets_spec)
+    _worker.update(shm=(coords_shm, offsets_shm), coords=coords, offsets=offsets, metric=metric, window=window)
+
+
+def _run_block(bounds):
+    start, stop = bounds
+    n_users = len(_worker['offsets']) - 1
+    rows, cols = _pair_slice(n_users, start, stop)
+    kernel = _KERNELS[_worker['metric']]
+    return kernel(_worker['coords'], _worker['offsets'], rows, cols, _worker['window'])
+
+
+def _pair_slice(n_users, start, stop):
+    # (row, col) indices of condensed pairs start..stop-1 without building the full pair list
+    r = np.arange(n_users, dtype=np.int64)
+    row_start = r * (2 * n_users - r - 1) // 2 # condensed index of the first pair of each row
+    k = np.arange(start, stop, dtype=np.int64)
+    rows = np.searchsorted(row_start, k, side='right') - 1
+    cols = k - row_start[rows] + rows + 1
+    return rows, cols
+
+
+def condensed_to_pair(n_users, k):
+    """
+    The (row, col) user indices of pair k in condensed order (see condensed_pairs), e.g. of
+    np.argmax of a condensed distance vector.
+    """
+    rows, cols = _pair_slice(n_users, k, k + 1)
+    return int(rows[0]), int(cols[0])
+
+
+def parallel_pairwise(coords, offsets, metric='dtw', window=None, n_workers=None, block_size=2048,
+                      user_ids=None, out_file=None, header=None):
+    """
+    Computes a distance for every user pair on a process pool.
+
+    The condensed pair space is cut into blocks of block_size pairs. The packed trajectories
+    are placed in shared memory once (or, for memory-mapped stores, re-opened by path) and every
+    worker attaches to them at start-up, so a task is just a (start, stop) range. Blocks come
+    back in order, so the output is deterministic.
+
+    Parameters:
+    - coords, offsets: packed trajectories (see pack_trajectories)
+    - metric: 'dtw' or 'euclidean' (mean point distance, -1 for different lengths)
+    - window: Sakoe-Chiba band half-width for 'dtw', None for exact DTW
+    - n_workers: number of processes, defaults to os.cpu_count()
+    - block_size: number of pairs per task
+    - user_ids, out_file, header: if out_file is given, each block is written as
+      "id1\tid2\tdist" lines (after the header line) as soon as it is ready
+
+    Returns:
+    - condensed distance vector in itertools.combinations order
+    """
+    if not isinstance(coords, np.memmap):
+        coords = np.ascontiguousarray(coords, dtype=np.float64)
+    if not isinstance(offsets, np.memmap):
+        offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+    n_users = len(offsets) - 1
+    n_pairs = n_users * (n_users - 1) // 2
+    dist = np.empty(n_pairs, dtype=np.float64)
+    blocks = [(start, min(start + block_size, n_pairs)) for start in range(0, n_pairs, block_size)]
+
+    output = open(out_file, 'w') if out_file else None
+    if output and header:
+        output.write(header)
+
+    coords_shm, coords_spec = _share(coords)
+    offsets_shm, offsets_spec = _share(offsets)
+    try:
+        with Pool(n_workers or os.cpu_count(), initializer=_init_worker,
+                  initargs=(coords_spec, offsets_spec, metric, window)) as pool:
+            for (start, stop), values in zip(blocks, pool.imap(_run_block, blocks)):
+                dist[start:stop] = values
+                if output:
+                    rows, cols = _pair_slice(n_users, start, stop)
+                    output.writelines(f"{user_ids[r]}\t{user_ids[c]}\t{v}\n" for r, c, v in zip(rows, cols, values))
+    finally:
+        for segment in (coords_shm, offsets_shm):
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+        if output:
+            output.close()
+    return dist
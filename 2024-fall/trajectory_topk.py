@@ -0,0 +1,168 @@
+"""
+Top-k nearest / farthest trajectory queries under DTW with lower and upper bound pruning.
+
+Candidates are visited in order of a constant-time bound (LB_Kim for the nearest pairs, a
+bounding box upper bound for the farthest pairs). A tighter bound is then checked per block
+(LB_Keogh / the cost of one valid warping path) and only the survivors get a full DTW, with
+early abandoning against the current k-th best distance. The search stops as soon as the next
+cheap bound cannot beat the k-th best, so most pairs never reach the DTW kernel.
+"""
+import numpy as np
+
+from trajectory_dtw import _padded, condensed_pairs, dtw_block, length_buckets
+
+
+def _point_dist(a, b):
+    return np.sqrt(((a - b) ** 2).sum(axis=-1))
+
+
+def _summaries(coords, offsets):
+    # first point, last point, length and bounding box of every user
+    starts = offsets[:-1]
+    first = coords[starts]
+    last = coords[offsets[1:] - 1]
+    lengths = np.diff(offsets)
+    box_min = np.minimum.reduceat(coords, starts, axis=0)
+    box_max = np.maximum.reduceat(coords, starts, axis=0)
+    return first, last, lengths, box_min, box_max
+
+
+def lb_kim(summary, rows, cols):
+    """
+    LB_Kim: every warping path starts at (0, 0) and ends at (n-1, m-1), so the cost of those two cells
+    is a lower bound of the DTW distance. O(1) per pair.
+    """
+    first, last, lengths, box_min, box_max = summary
+    bound = _point_dist(first[rows], first[cols])
+    both_single = (lengths[rows] == 1) & (lengths[cols] == 1) # start and end are the same cell
+    return bound + np.where(both_single, 0.0, _point_dist(last[rows], last[cols]))
+
+
+def ub_box(summary, rows, cols):
+    """
+    Upper bound of the DTW distance: a warping path has at most n + m - 1 cells and no cell can cost
+    more than the distance between the farthest corners of the two bounding boxes. O(1) per pair.
+    """
+    first, last, lengths, box_min, box_max = summary
+    span = np.maximum(box_max[rows], box_max[cols]) - np.minimum(box_min[rows], box_min[cols])
+    return (lengths[rows] + lengths[cols] - 1) * np.sqrt((span ** 2).sum(axis=1))
+
+
+def lb_keogh(coords, offsets, summary, rows, cols):
+    """
+    LB_Keogh with the bounding box of the other trajectory as envelope: every point of x is matched
+    to at least one point of y, which is no closer than y's bounding box (and the other way round).
+    The whole-trajectory envelope is also valid for Sakoe-Chiba banded DTW.
+    """
+    first, last, lengths, box_min, box_max = summary
+
+    def one_side(a, b):
+        bound = np.empty(len(a))
+        for idx in length_buckets(lengths[a]): # pad each group only to its own longest trajectory
+            x, x_len = _padded(coords, offsets, a[idx])
+            gap = np.maximum(box_min[b[idx]][:, None, :] - x, 0) + np.maximum(x - box_max[b[idx]][:, None, :], 0)
+            dist = np.sqrt((gap ** 2).sum(axis=2))
+            dist[np.arange(x.shape[1]) >= x_len[:, None]] = 0 # padding
+            bound[idx] = dist.sum(axis=1)
+        return bound
+
+    return np.maximum(one_side(rows, cols), one_side(cols, rows))
+
+
+def ub_path(coords, offsets, rows, cols):
+    """
+    Cost of one valid warping path (diagonal steps, then straight along the longer trajectory),
+    which is an upper bound of the DTW distance, banded or not.
+    """
+    lengths = offsets[1:] - offsets[:-1]
+    bound = np.empty(len(rows))
+    for idx in length_buckets(lengths[rows], lengths[cols]): # pairs of similar lengths are padded together
+        x, x_len = _padded(coords, offsets, rows[idx])
+        y, y_len = _padded(coords, offsets, cols[idx])
+        steps = np.arange(max(x.shape[1], y.shape[1]))
+        xi = np.minimum(steps, x_len[:, None] - 1)
+        yi = np.minimum(steps, y_len[:, None] - 1)
+        pair_idx = np.arange(len(idx))[:, None]
+        cost = _point_dist(x[pair_idx, xi], y[pair_idx, yi])
+        cost[steps >= np.maximum(x_len, y_len)[:, None]] = 0 # path is already at the end cell
+        bound[idx] = cost.sum(axis=1)
+    return bound
+
+
+def _search(coords, offsets, rows, cols, k, largest, window, block_size):
+    # generic bounded search over candidate pairs; works on keys (dist, or -dist when largest) so
+    # that "smaller key is better" and a bound can be skipped once it is >= the k-th best key
+    coords = np.asarray(coords, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    summary = _summaries(coords, offsets)
+    cheap = -ub_box(summary, rows, cols) if largest else lb_kim(summary, rows, cols)
+    order = np.argsort(cheap, kind='stable')
+
+    best_key = np.empty(0)
+    best_idx = np.empty(0, dtype=np.int64)
+    threshold = np.inf
+    for start in range(0, len(order), block_size):
+        idx = order[start:start + block_size]
+        if cheap[idx[0]] >= threshold: # candidates are sorted, so nothing after this can enter the top k
+            break
+        idx = idx[cheap[idx] < threshold]
+
+        # tighter bound on the survivors of the cheap bound
+        if largest:
+            tight = -ub_path(coords, offsets, rows[idx], cols[idx])
+        else:
+            tight = lb_keogh(coords, offsets, summary, rows[idx], cols[idx])
+        idx = idx[tight < threshold]
+        if len(idx) == 0:
+            continue
+
+        if largest:
+            key = -dtw_block(coords, offsets, rows[idx], cols[idx], window)
+        else:
+            key = dtw_block(coords, offsets, rows[idx], cols[idx], window, max_dist=threshold)
+
+        # merge the block into the current top k
+        best_key = np.concatenate([best_key, key])
+        best_idx = np.concatenate([best_idx, idx])
+        keep = np.argsort(best_key, kind='stable')[:k]
+        best_key, best_idx = best_key[keep], best_idx[keep]
+        if len(best_key) == k:
+            threshold = best_key[-1]
+
+    found = np.isfinite(best_key)
+    best_key, best_idx = best_key[found], best_idx[found]
+    dist = -best_key if largest else best_key
+    return rows[best_idx], cols[best_idx], dist
+
+
+def top_k_pairs(coords, offsets, k=1, largest=False, window=None, block_size=2048):
+    """
+    Finds the k user pairs with the smallest (or largest) DTW distance.
+
+    Parameters:
+    - coords, offsets: packed trajectories (see trajectory_dtw.pack_trajectories)
+    - k: number of pairs to return
+    - largest: True for the farthest pairs, False for the nearest pairs
+    - window: Sakoe-Chiba band half-width, None for exact DTW
+    - block_size: number of candidates bounded and checked at once
+
+    Returns:
+    - rows, cols: user indices of the pairs (rows < cols)
+    - dist: DTW distances, nearest first (or farthest first when largest=True)
+    """
+    rows, cols = condensed_pairs(len(offsets) - 1)
+    return _search(coords, offsets, rows, cols, k, largest, window, block_size)
+
+
+def nearest_neighbors(coords, offsets, query, k=1, farthest=False, window=None, block_size=2048):
+    """
+    Finds the k users closest to (or farthest from) the user with index query.
+
+    Returns:
+    - users: indices of the neighbours
+    - dist: their DTW distances to the query user
+    """
+    others = np.delete(np.arange(len(offsets) - 1, dtype=np.int64), query)
+    rows = np.full(len(others), query, dtype=np.int64)
+    rows, users, dist = _search(coords, offsets, rows, others, k, farthest, window, block_size)
+    return users, dist